@@ -1,15 +1,19 @@
 from flask import Flask, jsonify
 from flask_cors import CORS
-from app.routes import (
-    summary_routes, 
-    journal_routes, 
-    database_routes, 
-    music_routes, 
-    book_routes, 
-    project_routes
-)
 
 def create_app():
+    # Imported here, not at module level: routes set up their services on import,
+    # and worker processes importing app.services.* must not pay for that
+    from app.routes import (
+        summary_routes, 
+        journal_routes, 
+        database_routes, 
+        music_routes, 
+        book_routes, 
+        project_routes,
+        image_routes
+    )
+
     app = Flask(__name__)
 
     # Configure upload settings (set to 10MB for testing)
@@ -33,5 +37,6 @@ def create_app():
     app.register_blueprint(book_routes.book_bp, url_prefix='/book')
     app.register_blueprint(music_routes.music_bp, url_prefix='/music')
     app.register_blueprint(project_routes.project_routes, url_prefix='/project')
+    app.register_blueprint(image_routes.image_bp, url_prefix='/images')
 
     return app
\ No newline at end of file
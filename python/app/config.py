@@ -12,10 +12,33 @@ DB_PATH = os.path.join(DB_DIRECTORY, DB_FILENAME)
 IMAGE_LIBRARY_PATH = os.path.join(PROJECT_ROOT, '../Lossidian/03 Images')
 Path(IMAGE_LIBRARY_PATH).mkdir(parents=True, exist_ok=True)
 
+# Define the path to the image hash index (kept out of the vault)
+IMAGE_INDEX_PATH = os.path.join(DB_DIRECTORY, 'image_index.db')
+
+# Max perceptual-hash distance (bits out of 64) for an upload to count as a near-duplicate and be skipped,
+# -1 to disable. Off by default: burst shots and lightly edited copies can match too and would be dropped
+IMAGE_NEAR_DUPLICATE_THRESHOLD = -1
+
+# Define the path to the image thumbnail cache and its size budget
+THUMBNAIL_CACHE_PATH = os.path.join(DB_DIRECTORY, 'thumbnails')
+THUMBNAIL_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Optional background re-encoding of oversized uploads (needs Pillow); format is 'JPEG' or 'WEBP'
+IMAGE_RECOMPRESS = False
+IMAGE_MAX_DIMENSION = 3072
+IMAGE_RECOMPRESS_QUALITY = 85
+IMAGE_RECOMPRESS_FORMAT = 'JPEG'
+
 # Define the path to the musicLibrary folder
 MUSIC_LIBRARY_PATH = os.path.join(PROJECT_ROOT, '../Lossidian/02 Music')
 Path(MUSIC_LIBRARY_PATH).mkdir(parents=True, exist_ok=True)
 
+# Define the path to the music metadata index (tags and full-text search)
+MUSIC_INDEX_PATH = os.path.join(DB_DIRECTORY, 'music_index.db')
+
+# Define the path to the media hash store (content hashes of music and book files)
+MEDIA_HASH_STORE_PATH = os.path.join(DB_DIRECTORY, 'media_hashes.db')
+
 # Define the path to the bookLibrary folder
 BOOK_LIBRARY_PATH = os.path.join(PROJECT_ROOT, '../Lossidian/01 Books')
 Path(BOOK_LIBRARY_PATH).mkdir(parents=True, exist_ok=True)
@@ -1,9 +1,10 @@
-from flask import Blueprint, jsonify, send_file, make_response, abort, request
-import os
+from flask import Blueprint, jsonify, make_response, abort, request
 from pathlib import Path
 from urllib.parse import unquote  # Add this import at the top
 
+from app.services.library_index.library_index import is_pending, HASH_RETRY_AFTER_SECONDS
 from app.services.book_sync.book_sync import BookSync
+from app.services.route_services.file_serving import send_library_file, send_archive
 from app.config import BOOK_LIBRARY_PATH
 from logger import logger
 
@@ -24,6 +25,27 @@ def get_book_list():
         logger.error(f"Failed to get book list: {str(e)}")
         return jsonify({"error": "Failed to get book list"}), 500
 
+@book_bp.route('/files', methods=['GET'])
+def get_books_files():
+    """
+    Retrieves the files of many books in one request, instead of one request per book.
+    Query: books (repeatable, else all books a page at a time), since (unix time), cursor, limit.
+    Keep server_time from the first page as the next sync's `since`.
+    """
+    try:
+        names = request.args.getlist('books') or None
+        since = request.args.get('since', type=float)
+        limit = max(1, min(request.args.get('limit', default=100, type=int), 1000))
+        books, next_cursor, server_time = book_sync.get_books_files(names, since, request.args.get('cursor'), limit)
+        return jsonify({
+            "books": books,
+            "next_cursor": next_cursor,
+            "server_time": server_time
+        }), 200
+    except Exception as e:
+        logger.error(f"Failed to get book files: {str(e)}")
+        return jsonify({"error": "Failed to get book files"}), 500
+
 @book_bp.route('/<book_name>/files', methods=['GET'])
 def get_book_files(book_name):
     try:
@@ -48,17 +70,63 @@ def prepare_book_for_sync(book_name):
         book_name = unquote(book_name)
         logger.info(f"Decoded book name: {book_name}")
         
-        if not book_sync.book_exists(book_name):
-            logger.error(f"Book not found during sync: {book_name}")
-            return jsonify({"error": "Book not found"}), 404
-            
-        files = book_sync.get_book_files(book_name)
+        files = book_sync.get_book_manifest(book_name)
+        if is_pending(files):
+            # First sync of new or edited files: they are being hashed in the background
+            logger.info(f"Prepared book '{book_name}' for sync with {len(files)} files, hashes pending.")
+            response = make_response(jsonify(files), 202)
+            response.headers['Retry-After'] = str(HASH_RETRY_AFTER_SECONDS)
+            return response
         logger.info(f"Prepared book '{book_name}' for sync with {len(files)} files.")
         return jsonify(files), 200
+    except FileNotFoundError:
+        logger.error(f"Book not found during sync: {book_name}")
+        return jsonify({"error": "Book not found"}), 404
     except Exception as e:
         logger.error(f"Failed to prepare book for sync: {book_name}: {str(e)}")
         return jsonify({"error": "Failed to prepare book for sync"}), 500
     
+@book_bp.route('/sync/<book_name>/diff', methods=['POST'])
+def diff_book(book_name):
+    """
+    Takes the phone's manifest of a book ({"files": [{name, size, sha256}]})
+    and returns only the files to fetch and the names to delete.
+    """
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('files'), list):
+            return jsonify({"error": "No files in request"}), 400
+
+        diff = book_sync.diff_book(unquote(book_name), data['files'])
+        logger.info(f"Book '{book_name}' diff: {len(diff['fetch'])} to fetch, {len(diff['delete'])} to delete.")
+        return jsonify(diff), 200
+    except ValueError as e:
+        logger.error(f"Invalid diff request for {book_name}: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+    except FileNotFoundError:
+        logger.error(f"Book not found during diff: {book_name}")
+        return jsonify({"error": "Book not found"}), 404
+    except Exception as e:
+        logger.error(f"Failed to diff book {book_name}: {str(e)}")
+        return jsonify({"error": "Failed to diff book"}), 500
+    
+@book_bp.route('/archive/<book_name>', methods=['GET'])
+def get_book_archive(book_name):
+    """
+    Streams a whole book (or ?files=...) as one tar, with Range support for resuming.
+    """
+    try:
+        book_name = unquote(book_name)
+        archive = book_sync.get_book_archive(book_name, request.args.getlist('files') or None)
+        logger.info(f"Streaming book '{book_name}' archive: {archive.size} bytes.")
+        return send_archive(archive, f"{book_name}.tar")
+    except FileNotFoundError as e:
+        logger.error(f"Book or file not found for archive: {book_name}: {str(e)}")
+        return jsonify({"error": "Book or file not found"}), 404
+    except Exception as e:
+        logger.error(f"Failed to stream book archive {book_name}: {str(e)}")
+        return jsonify({"error": "Failed to stream book archive"}), 500
+    
 @book_bp.route('/file/<book_name>/<file_name>', methods=['GET'])
 def get_file(book_name, file_name):
     """
@@ -74,20 +142,8 @@ def get_file(book_name, file_name):
             logger.error(f"Attempted path traversal detected: {file_path}")
             return jsonify({"error": "Invalid file path"}), 400
 
-        # Serve the file
-        response = make_response(send_file(
-            file_path,
-            mimetype='application/epub+zip',
-            as_attachment=True,
-            download_name=file_name
-        ))
-
-        # Add headers with ASCII-compatible filename
-        safe_filename = file_name.encode('ascii', 'replace').decode('ascii')
-        response.headers['Content-Disposition'] = f'attachment; filename="{safe_filename}"'
-        response.headers['Content-Length'] = os.path.getsize(file_path)
-
-        return response
+        # Serve the file, with Range and conditional request support
+        return send_library_file(file_path, 'application/epub+zip', file_name)
 
     except FileNotFoundError:
         logger.error(f"File not found: {book_name}/{file_name}")
@@ -1,73 +1,233 @@
 from flask import Blueprint, jsonify, request, send_file
+from werkzeug.datastructures import FileStorage
 import os
 from datetime import datetime
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 
-from app.services.image_sync.image_sync import save_images
-from app.services.route_services.database_services import cleanup_old_backups
+from app.services.image_sync.image_sync import save_images, find_existing_images, get_month_name
+from app.services.backup_store.backup_store import BackupStore
+from app.services.upload_sessions.upload_sessions import UploadSessions, UploadSessionError, DEFAULT_CHUNK_SIZE
+from app.services.route_services.database_services import schedule_cleanup
+from app.services.route_services.db_ingest import (
+    receive_stream,
+    ingest_file,
+    get_db_hash,
+    hash_file,
+    publish,
+    copy_for_update,
+    get_compressed_path,
+    get_available_encodings,
+    write_lock,
+    HashMismatchError,
+    InvalidDatabaseError,
+    check_database_file,
+    RAW_DB_MIMETYPES
+)
+from app.services.route_services.db_generations import generations
+from app.services.route_services.delta_sync import get_watermarks, apply_delta, validate_delta, SchemaMismatchError, InvalidDeltaError
 from app.config import DB_PATH, DB_DIRECTORY, DB_FILENAME
 from logger import logger
 
 bp = Blueprint('database', __name__)
 
+BACKUP_DIRECTORY = os.path.join(DB_DIRECTORY, 'backups')
+BACKUP_KEEP_LAST = 300
+
+# Initialize BackupStore
+backup_store = BackupStore(os.path.join(BACKUP_DIRECTORY, 'store'))
+
+# Initialize UploadSessions, beside DB_PATH so committed databases are renamed into place
+upload_sessions = UploadSessions(os.path.join(DB_DIRECTORY, 'upload_sessions'))
+
+def backup_published_db(generation) -> str:
+    """
+    Stores a deduplicated backup of the generation just published. Old ones are
+    pruned every few backups in the background, outside write_lock.
+    """
+    # Generate timestamp for backup name, to the microsecond so syncs in the same second don't collide
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+    backup_name = f'LocalDB_{timestamp}'
+
+    # Only changed pages take new space; the store adds a suffix if the name is taken
+    backup_name = backup_store.add_backup(generation.path, name=backup_name)['name']
+    logger.info("Backup created: %s", backup_name)
+
+    # Maintain only last N backups
+    schedule_cleanup(backup_store, BACKUP_DIRECTORY, keep_last=BACKUP_KEEP_LAST)
+    return backup_name
+
+def save_attached_images(date_str: str, images):
+    """
+    Saves the images attached to a sync request. Returns (saved_images, duplicates);
+    failures are logged, not raised, so they never fail the database upload.
+    """
+    try:
+        saved_images, duplicates = save_images(date_str, images)
+        logger.info(f"Saved {len(saved_images)} images, {duplicates} duplicates skipped")
+        return saved_images, duplicates
+    except Exception as e:
+        logger.error(f"Error processing images: {str(e)}")
+        return [], 0
+
+def get_image_results(images_future) -> dict:
+    """
+    The images a sync request saved, for its response. Also reported with an
+    error, so the phone doesn't send images again that are already stored.
+    """
+    saved_images, duplicates = images_future.result() if images_future else ([], 0)
+    return {"saved_images": saved_images, "duplicates": duplicates}
+
 # from phone to desktop
 @bp.route('/upload_sqlite', methods=['POST'])
 def upload_sqlite():
+    images_future = None
     try:
-        if 'file' not in request.files:
-            logger.error("No file part in the request")
+        is_multipart = request.mimetype == 'multipart/form-data'
+        logger.info("Request size: %s bytes", request.content_length)
+        if not is_multipart and request.mimetype not in RAW_DB_MIMETYPES:
+            logger.error("Rejected upload with content type %s", request.mimetype)
             return jsonify({"error": "No file part in the request"}), 400
-            
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({"error": "No selected file"}), 400
-        
-        # Create backups directory if it doesn't exist
-        backup_dir = os.path.join(DB_DIRECTORY, 'backups')
-        os.makedirs(backup_dir, exist_ok=True)
-        
-        # Generate timestamp for backup file
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_filename = f'LocalDB_{timestamp}.db'
-        backup_path = os.path.join(backup_dir, backup_filename)
-        
-        # Save the current file
-        file.save(DB_PATH)
-        logger.info("Database saved to: %s", DB_PATH)
-        
-        # Create backup copy
-        shutil.copy2(DB_PATH, backup_path)
-        logger.info("Backup created at: %s", backup_path)
-        
-        # Handle images if they're included in the request
-        saved_images = []
-        duplicates = 0
 
-        logger.info("Request size: %s bytes", request.content_length)
-        
-        logger.info(request.form)
-        if 'images' in request.form and 'date' in request.form:
+        # Validate everything before the first image is saved
+        # Reading request.files streams every part to a spooled temp file
+        images = request.files.getlist('images') if is_multipart else []
+        date_str = request.form.get('date') if is_multipart else None
+        if images:
+            if not date_str:
+                return jsonify({"error": "Images were sent without a date"}), 400
             try:
-                images = request.form.getlist('images')
-                date_str = request.form['date']
-                saved_images, duplicates = save_images(date_str, images)
-                logger.info(f"Saved {len(saved_images)} images, {duplicates} duplicates skipped")
-            except Exception as e:
-                logger.error(f"Error processing images: {str(e)}")
-                # Continue with the response even if image processing fails
-        
-        # Maintain only last N backups
-        cleanup_old_backups(backup_dir, keep_last=10)
+                get_month_name(date_str)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+
+        # Skip the database entirely when the server already has this exact one
+        expected_hash = request.headers.get('X-Content-SHA256')
+        unchanged = bool(expected_hash) and expected_hash.lower() == get_db_hash()
+
+        if is_multipart and not unchanged:
+            if 'file' not in request.files:
+                logger.error("No file part in the request")
+                return jsonify({"error": "No file part in the request"}), 400
+            if request.files['file'].filename == '':
+                return jsonify({"error": "No selected file"}), 400
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # Images arrive as file parts and are ingested alongside the database, not after it
+            if images:
+                images_future = executor.submit(save_attached_images, date_str, images)
+
+            if unchanged:
+                logger.info("Database unchanged (%s), skipping upload", expected_hash[:12])
+                return jsonify({
+                    "message": "Database already up to date",
+                    "unchanged": True,
+                    "sha256": expected_hash.lower(),
+                    **get_image_results(images_future)
+                }), 200
+
+            # Raw body: the request stream is written straight to disk, with no spooling
+            stream = request.files['file'].stream if is_multipart else request.stream
+            
+            # Write the upload once while hashing it, before taking the lock: a slow
+            # phone upload must not hold up delta syncs and chunked commits
+            tmp_path, sha = receive_stream(stream, expected_hash)
+            try:
+                with write_lock:
+                    generation = publish(tmp_path, sha)
+                    logger.info("Database saved to: %s", generation.path)
+
+                    backup_name = backup_published_db(generation)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+            image_results = get_image_results(images_future)
         
         return jsonify({
             "message": "SQLite database uploaded successfully",
-            "backup_path": backup_path,
-            "saved_images": saved_images,
-            "duplicates": duplicates
+            "backup": backup_name,
+            "sha256": generation.sha,
+            **image_results
         }), 200
         
+    except (HashMismatchError, InvalidDatabaseError) as e:
+        logger.error("Rejected upload: %s", str(e))
+        return jsonify({"error": str(e), **get_image_results(images_future)}), 400
     except Exception as e:
         logger.error("Error in upload_sqlite: %s", str(e), exc_info=True)
+        return jsonify({"error": str(e), **get_image_results(images_future)}), 500
+
+@bp.route('/db_hash', methods=['GET'])
+def db_hash():
+    """
+    Returns the hash of the current database so the phone can skip unchanged uploads.
+    """
+    try:
+        sha = get_db_hash()
+        if sha is None:
+            return jsonify({"error": "Database file not found"}), 404
+
+        return jsonify({"sha256": sha}), 200
+
+    except Exception as e:
+        logger.error("Error in db_hash: %s", str(e), exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/sync_watermarks', methods=['GET'])
+def sync_watermarks():
+    """
+    Returns the newest updatedAt per table so the phone knows which rows to send.
+    """
+    try:
+        with generations.pinned() as generation:
+            if generation is None:
+                return jsonify({"error": "Database file not found"}), 404
+
+            return jsonify({"watermarks": get_watermarks(generation.path)}), 200
+
+    except Exception as e:
+        logger.error("Error in sync_watermarks: %s", str(e), exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+# from phone to desktop, only the rows changed since the last sync
+@bp.route('/upload_delta', methods=['POST'])
+def upload_delta():
+    try:
+        if get_db_hash() is None:
+            return jsonify({"error": "Database file not found, a full upload is required"}), 409
+
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('tables'), dict):
+            return jsonify({"error": "No tables in request"}), 400
+        # Reject a malformed delta before copying the database for it
+        validate_delta(data['tables'], data.get('deleted'))
+
+        # Apply to a private copy and publish it, so readers and backups never see a half-applied delta
+        with write_lock:
+            tmp_path = copy_for_update()
+            try:
+                applied, watermarks = apply_delta(tmp_path, data['tables'], data.get('deleted'))
+                publish(tmp_path, hash_file(tmp_path))
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        logger.info("Delta sync applied %s rows", sum(applied.values()))
+
+        return jsonify({
+            "message": "Delta applied successfully",
+            "applied": applied,
+            "watermarks": watermarks
+        }), 200
+
+    except InvalidDeltaError as e:
+        logger.error("Invalid delta in upload_delta: %s", str(e))
+        return jsonify({"error": str(e)}), 400
+    except SchemaMismatchError as e:
+        # The phone falls back to /upload_sqlite when the schema has changed
+        logger.error("Schema mismatch in upload_delta: %s", str(e))
+        return jsonify({"error": str(e), "full_upload_required": True}), 409
+    except Exception as e:
+        logger.error("Error in upload_delta: %s", str(e), exc_info=True)
         return jsonify({"error": str(e)}), 500
 
 @bp.route('/upload_images', methods=['POST'])
@@ -96,6 +256,156 @@ def upload_images():
         logger.error("Error in upload_images: %s", str(e), exc_info=True)
         return jsonify({"error": str(e)}), 500
 
+# dedupe handshake: the phone sends hashes first and uploads only the images the server lacks
+@bp.route('/image_lookup', methods=['POST'])
+def image_lookup():
+    try:
+        data = request.get_json(silent=True)
+        entries = data.get('images') if isinstance(data, dict) else None
+        if not isinstance(entries, list):
+            return jsonify({"error": "No images in request"}), 400
+        if not all(isinstance(entry, dict) and entry.get('date') and entry.get('sha256') for entry in entries):
+            return jsonify({"error": "Every image needs a date and a sha256"}), 400
+
+        known = find_existing_images(entries)
+
+        # Indices into the request list, so the same hash under two dates stays unambiguous
+        return jsonify({
+            "known": [i for i, is_known in enumerate(known) if is_known],
+            "missing": [i for i, is_known in enumerate(known) if not is_known]
+        }), 200
+
+    except ValueError as e:
+        logger.error("Invalid request in image_lookup: %s", str(e))
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error("Error in image_lookup: %s", str(e), exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+# resumable chunked uploads, for large files over flaky connections
+@bp.route('/uploads', methods=['POST'])
+def create_upload():
+    try:
+        data = request.get_json(silent=True) or {}
+        kind = data.get('kind')
+        if kind == 'image' and not (data.get('filename') and data.get('date')):
+            return jsonify({"error": "Image uploads need a filename and a date"}), 400
+
+        extra = {key: data[key] for key in ('filename', 'date') if data.get(key)}
+        meta = upload_sessions.create_session(
+            kind,
+            int(data.get('size', 0)),
+            chunk_size=int(data.get('chunk_size', DEFAULT_CHUNK_SIZE)),
+            sha256=data.get('sha256'),
+            **extra
+        )
+
+        return jsonify({
+            "upload_id": meta['upload_id'],
+            "chunk_size": meta['chunk_size'],
+            "total_chunks": meta['total_chunks']
+        }), 201
+
+    except (UploadSessionError, ValueError) as e:
+        logger.error("Invalid upload session request: %s", str(e))
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error("Error in create_upload: %s", str(e), exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    try:
+        upload_sessions.write_chunk(upload_id, index, request.stream, request.headers.get('X-Chunk-SHA256'))
+        return jsonify({"received": index}), 200
+
+    except FileNotFoundError:
+        return jsonify({"error": "Upload session not found"}), 404
+    except UploadSessionError as e:
+        logger.error("Rejected chunk %s for upload %s: %s", index, upload_id, str(e))
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error("Error in upload_chunk: %s", str(e), exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload_status(upload_id):
+    """
+    Returns the chunks still missing, so the phone can resume after a dropped connection.
+    """
+    try:
+        meta = upload_sessions.get_meta(upload_id)
+        missing = upload_sessions.get_missing_chunks(upload_id)
+        return jsonify({
+            "upload_id": upload_id,
+            "total_chunks": meta['total_chunks'],
+            "chunk_size": meta['chunk_size'],
+            "missing": missing
+        }), 200
+
+    except FileNotFoundError:
+        return jsonify({"error": "Upload session not found"}), 404
+    except Exception as e:
+        logger.error("Error in get_upload_status: %s", str(e), exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/uploads/<upload_id>/commit', methods=['POST'])
+def commit_upload(upload_id):
+    try:
+        meta = upload_sessions.verify_complete(upload_id)
+        data_path = upload_sessions.get_data_path(upload_id)
+
+        if meta['kind'] == 'db':
+            # Checked and hashed before taking the lock, only the publish is serialized
+            check_database_file(data_path)
+            sha = meta['sha256'] or hash_file(data_path)
+            with write_lock:
+                generation = ingest_file(data_path, sha)
+                backup_name = backup_published_db(generation)
+            upload_sessions.delete_session(upload_id)
+
+            return jsonify({
+                "message": "SQLite database uploaded successfully",
+                "backup": backup_name,
+                "sha256": generation.sha
+            }), 200
+
+        with open(data_path, 'rb') as f:
+            saved_images, duplicates = save_images(meta['date'], [FileStorage(stream=f, filename=meta['filename'])])
+        upload_sessions.delete_session(upload_id)
+
+        return jsonify({
+            "message": "Images uploaded successfully",
+            "saved_images": saved_images,
+            "duplicates": duplicates
+        }), 200
+
+    except FileNotFoundError:
+        return jsonify({"error": "Upload session not found"}), 404
+    except UploadSessionError as e:
+        logger.error("Cannot commit upload %s: %s", upload_id, str(e))
+        return jsonify({"error": str(e)}), 400
+    except InvalidDatabaseError as e:
+        # The assembled bytes are not a database, a retry has to start a new upload
+        logger.error("Rejected upload %s: %s", upload_id, str(e))
+        upload_sessions.delete_session(upload_id)
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error("Error in commit_upload: %s", str(e), exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+@bp.route('/uploads/<upload_id>', methods=['DELETE'])
+def delete_upload(upload_id):
+    try:
+        upload_sessions.delete_session(upload_id)
+        return jsonify({"message": "Upload session deleted"}), 200
+
+    except FileNotFoundError:
+        return jsonify({"error": "Upload session not found"}), 404
+    except Exception as e:
+        logger.error("Error in delete_upload: %s", str(e), exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
 @bp.route('/upload_json', methods=['POST'])
 def upload_json():
     try:
@@ -119,20 +429,49 @@ def upload_json():
 @bp.route('/download_db', methods=['GET'])
 def download_db():
     try:
-        if not os.path.exists(DB_PATH):
-            logger.error(f"Database file not found at {DB_PATH}")
-            return jsonify({"error": "Database file not found"}), 404
-            
-        return send_file(
-            DB_PATH,
-            mimetype='application/octet-stream',
-            as_attachment=True,
-            download_name=DB_FILENAME,
-            # Add cache prevention headers
-            etag=None,
-            last_modified=None,
-            max_age=0
-        )
+        # Pin the current generation while the file is opened, the open handle keeps
+        # reading the same immutable file even if an upload publishes a new one
+        with generations.pinned() as generation:
+            if generation is None:
+                logger.error(f"Database file not found at {DB_PATH}")
+                return jsonify({"error": "Database file not found"}), 404
+
+            response = None
+
+            # Serve a copy compressed once at upload time, if the phone accepts it
+            for encoding in get_available_encodings():
+                compressed_path = get_compressed_path(generation.sha, encoding)
+                if encoding in request.accept_encodings and os.path.exists(compressed_path):
+                    try:
+                        response = send_file(
+                            compressed_path,
+                            mimetype='application/octet-stream',
+                            as_attachment=True,
+                            download_name=DB_FILENAME,
+                            etag=f"{generation.sha}-{encoding}",
+                            max_age=0,
+                            conditional=True
+                        )
+                    except FileNotFoundError:
+                        # Replaced by a newer upload in the meantime
+                        continue
+                    response.headers['Content-Encoding'] = encoding
+                    break
+
+            if response is None:
+                # The ETag is the content hash, so unchanged databases get a 304 instead of a download
+                response = send_file(
+                    generation.path,
+                    mimetype='application/octet-stream',
+                    as_attachment=True,
+                    download_name=DB_FILENAME,
+                    etag=generation.sha,
+                    max_age=0,
+                    conditional=True
+                )
+
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
     except Exception as e:
         logger.error(f"Error in download_db: {str(e)}", exc_info=True)
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
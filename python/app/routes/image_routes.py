@@ -0,0 +1,75 @@
+import time
+from flask import Blueprint, jsonify, send_file, request, url_for
+from logger import logger
+
+from app.services.image_sync.image_sync import get_thumbnail, get_manifest, image_index, thumbnail_cache, MANIFEST_PAGE_SIZE
+
+image_bp = Blueprint('images', __name__)
+
+# Thumbnails are keyed by content hash, clients revalidate with the ETag after this
+THUMBNAIL_MAX_AGE = 7 * 24 * 60 * 60
+
+@image_bp.route('/thumb/<path:image_path>', methods=['GET'])
+def get_thumbnail_file(image_path):
+    """
+    Serves a thumbnail of a library image, e.g. /images/thumb/2024/05 May/2024-05-03_1.jpg
+    """
+    try:
+        if not thumbnail_cache.is_available():
+            return jsonify({"error": "Thumbnails are not available on this server"}), 501
+
+        thumb_path, key = get_thumbnail(image_path)
+        return send_file(
+            thumb_path,
+            mimetype=thumbnail_cache.mimetype,
+            etag=key,
+            conditional=True,
+            max_age=THUMBNAIL_MAX_AGE
+        )
+    except FileNotFoundError:
+        logger.error(f"Image not found for thumbnail: {image_path}")
+        return jsonify({"error": "Image not found"}), 404
+    except Exception as e:
+        logger.error(f"Failed to serve thumbnail for {image_path}: {str(e)}")
+        return jsonify({"error": "Failed to serve thumbnail"}), 500
+
+@image_bp.route('/manifest', methods=['GET'])
+def get_image_manifest():
+    """
+    Lists the image library page by page from the image index.
+    Query: cursor (from the previous page), since (unix time, only images added later), limit.
+    Keep server_time from the first page as the next sync's `since`.
+    """
+    try:
+        server_time = time.time()
+        since = request.args.get('since', type=float)
+        limit = request.args.get('limit', default=MANIFEST_PAGE_SIZE, type=int)
+        images, next_cursor = get_manifest(request.args.get('cursor'), since, limit)
+
+        # Without Pillow every thumbnail request answers 501, so none are advertised
+        if thumbnail_cache.is_available():
+            for image in images:
+                image['thumbnail_url'] = url_for('images.get_thumbnail_file', image_path=image['path'])
+
+        return jsonify({
+            "images": images,
+            "next_cursor": next_cursor,
+            "server_time": server_time
+        }), 200
+    except ValueError as e:
+        logger.error(f"Invalid manifest request: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"Failed to get image manifest: {str(e)}")
+        return jsonify({"error": "Failed to get image manifest"}), 500
+
+@image_bp.route('/stats', methods=['GET'])
+def get_image_stats():
+    """
+    Reports the storage saved by server-side recompression.
+    """
+    try:
+        return jsonify(image_index.get_recompression_stats()), 200
+    except Exception as e:
+        logger.error(f"Failed to get image stats: {str(e)}")
+        return jsonify({"error": "Failed to get image stats"}), 500
@@ -1,9 +1,10 @@
-from flask import Blueprint, jsonify, send_file, make_response, abort
-import os
+from flask import Blueprint, jsonify, make_response, abort, request
 from pathlib import Path
 from logger import logger
 
+from app.services.library_index.library_index import is_pending, HASH_RETRY_AFTER_SECONDS
 from app.services.music_sync.music_sync import MusicSync
+from app.services.route_services.file_serving import send_library_file, send_archive
 from app.config import MUSIC_LIBRARY_PATH
 
 music_bp = Blueprint('music', __name__)
@@ -11,6 +12,14 @@ music_bp = Blueprint('music', __name__)
 # Initialize MusicSync
 music_sync = MusicSync(MUSIC_LIBRARY_PATH)
 
+@music_bp.before_request
+def start_metadata_index():
+    """
+    Starts the tag indexer on the first music request rather than at import, so
+    the debug reloader's parent process (which serves nothing) never runs one.
+    """
+    music_sync.metadata_index.start()
+
 @music_bp.route('/albums', methods=['GET'])
 def get_album_list():
     """
@@ -23,6 +32,46 @@ def get_album_list():
         logger.error(f"Failed to get album list: {str(e)}")
         return jsonify({"error": "Failed to get album list"}), 500
 
+@music_bp.route('/albums/files', methods=['GET'])
+def get_albums_files():
+    """
+    Retrieves the files of many albums in one request, instead of one request per album.
+    Query: albums (repeatable, else all albums a page at a time), since (unix time), cursor, limit.
+    Keep server_time from the first page as the next sync's `since`.
+    """
+
+    try:
+        names = request.args.getlist('albums') or None
+        since = request.args.get('since', type=float)
+        limit = max(1, min(request.args.get('limit', default=100, type=int), 1000))
+        albums, next_cursor, server_time = music_sync.get_albums_files(names, since, request.args.get('cursor'), limit)
+        return jsonify({
+            "albums": albums,
+            "next_cursor": next_cursor,
+            "server_time": server_time
+        }), 200
+    except Exception as e:
+        logger.error(f"Failed to get album files: {str(e)}")
+        return jsonify({"error": "Failed to get album files"}), 500
+
+@music_bp.route('/search', methods=['GET'])
+def search_music():
+    """
+    Searches the music library by title, artist, album or file name: /music/search?q=...&limit=50
+    """
+
+    try:
+        query = request.args.get('q', '')
+        limit = max(1, min(request.args.get('limit', default=50, type=int), 500))
+        results = music_sync.search(query, limit)
+        return jsonify({
+            "results": results,
+            "indexing": music_sync.metadata_index.indexing
+        }), 200
+    except Exception as e:
+        logger.error(f"Failed to search music for '{request.args.get('q')}': {str(e)}")
+        return jsonify({"error": "Failed to search music"}), 500
+
 @music_bp.route('/albums/<album_name>/files', methods=['GET'])
 def get_album_files(album_name):
     """
@@ -42,11 +91,18 @@ def get_album_files(album_name):
 @music_bp.route('/sync/<album_name>', methods=['POST'])
 def prepare_album_for_sync(album_name):
     """
-    Prepares the album for synchronization by retrieving its files.
+    Prepares the album for synchronization by retrieving its files, with size, mtime and sha256.
+    Answers 202 with sha256 null for files still being hashed, to be asked again after Retry-After.
     """
 
     try:
-        files = music_sync.get_album_files(album_name)
+        files = music_sync.get_album_manifest(album_name)
+        if is_pending(files):
+            # First sync of new or edited files: they are being hashed in the background
+            logger.info(f"Prepared album '{album_name}' for sync with {len(files)} files, hashes pending.")
+            response = make_response(jsonify(files), 202)
+            response.headers['Retry-After'] = str(HASH_RETRY_AFTER_SECONDS)
+            return response
         logger.info(f"Prepared album '{album_name}' for sync with {len(files)} files.")
         return jsonify(files), 200
     except FileNotFoundError:
@@ -56,6 +112,48 @@ def prepare_album_for_sync(album_name):
         logger.error(f"Failed to prepare album for sync: {album_name}: {str(e)}")
         return jsonify({"error": "Failed to prepare album for sync"}), 500
 
+@music_bp.route('/sync/<album_name>/diff', methods=['POST'])
+def diff_album(album_name):
+    """
+    Takes the phone's manifest of an album ({"files": [{name, size, sha256}]})
+    and returns only the files to fetch and the names to delete.
+    """
+
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('files'), list):
+            return jsonify({"error": "No files in request"}), 400
+
+        diff = music_sync.diff_album(album_name, data['files'])
+        logger.info(f"Album '{album_name}' diff: {len(diff['fetch'])} to fetch, {len(diff['delete'])} to delete.")
+        return jsonify(diff), 200
+    except ValueError as e:
+        logger.error(f"Invalid diff request for {album_name}: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+    except FileNotFoundError:
+        logger.error(f"Album not found during diff: {album_name}")
+        return jsonify({"error": "Album not found"}), 404
+    except Exception as e:
+        logger.error(f"Failed to diff album {album_name}: {str(e)}")
+        return jsonify({"error": "Failed to diff album"}), 500
+
+@music_bp.route('/archive/<album_name>', methods=['GET'])
+def get_album_archive(album_name):
+    """
+    Streams a whole album (or ?files=a.mp3&files=b.mp3) as one tar, with Range support for resuming.
+    """
+
+    try:
+        archive = music_sync.get_album_archive(album_name, request.args.getlist('files') or None)
+        logger.info(f"Streaming album '{album_name}' archive: {archive.size} bytes.")
+        return send_archive(archive, f"{album_name}.tar")
+    except FileNotFoundError as e:
+        logger.error(f"Album or file not found for archive: {album_name}: {str(e)}")
+        return jsonify({"error": "Album or file not found"}), 404
+    except Exception as e:
+        logger.error(f"Failed to stream album archive {album_name}: {str(e)}")
+        return jsonify({"error": "Failed to stream album archive"}), 500
+
 @music_bp.route('/file/<album_name>/<file_name>', methods=['GET'])
 def get_file(album_name, file_name):
     """
@@ -71,20 +169,8 @@ def get_file(album_name, file_name):
             logger.error(f"Attempted path traversal detected: {file_path}")
             return jsonify({"error": "Invalid file path"}), 400
 
-        # Serve the file
-        response = make_response(send_file(
-            file_path,
-            mimetype='audio/mpeg',
-            as_attachment=True,
-            download_name=file_name
-        ))
-
-        # Add headers with ASCII-compatible filename
-        safe_filename = file_name.encode('ascii', 'replace').decode('ascii')
-        response.headers['Content-Disposition'] = f'attachment; filename="{safe_filename}"'
-        response.headers['Content-Length'] = os.path.getsize(file_path)
-
-        return response
+        # Serve the file, with Range and conditional request support
+        return send_library_file(file_path, 'audio/mpeg', file_name)
 
     except FileNotFoundError:
         logger.error(f"File not found: {album_name}/{file_name}")
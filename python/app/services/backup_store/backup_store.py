@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import zlib
+import hashlib
+import tempfile
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+from logger import logger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+DEFAULT_PAGE_SIZE = 4096
+PAGES_PER_CHUNK = 4
+# Chunks touched this recently before a prune started are kept, in case of coarse mtimes
+PRUNE_GRACE_SECONDS = 2
+
+class BackupStore:
+    """
+    Content-addressed store of database backups.
+
+    Each backup is split into page-aligned chunks; every unique chunk is stored
+    once, compressed, under objects/, and each backup is a small JSON manifest
+    listing its chunk hashes. Consecutive syncs share almost all pages, so
+    hundreds of restore points fit in the space of a few full copies.
+
+    Backups can be added while a prune runs: a chunk is touched whenever a
+    backup reuses it, and prune leaves chunks touched after it started.
+    """
+
+    def __init__(self, store_path, pages_per_chunk: int = PAGES_PER_CHUNK):
+        self.store_path = Path(store_path).resolve()
+        self.objects_path = self.store_path / 'objects'
+        self.manifests_path = self.store_path / 'manifests'
+        self.pages_per_chunk = pages_per_chunk
+        self.codec = 'zstd' if zstandard else 'zlib'
+        # Held per chunk, between checking a chunk and reusing or deleting it
+        self.object_lock = threading.Lock()
+        self.initialize()
+
+    def initialize(self):
+        self.objects_path.mkdir(parents=True, exist_ok=True)
+        self.manifests_path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def get_page_size(path) -> int:
+        """Reads the page size from the SQLite header, or a default for other files."""
+        with open(path, 'rb') as f:
+            header = f.read(100)
+        if not header.startswith(SQLITE_HEADER) or len(header) < 18:
+            return DEFAULT_PAGE_SIZE
+        page_size = int.from_bytes(header[16:18], 'big')
+        return 65536 if page_size == 1 else page_size
+
+    def _object_path(self, chunk_hash: str, codec: str) -> Path:
+        return self.objects_path / chunk_hash[:2] / f"{chunk_hash}.{codec}"
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.codec == 'zstd':
+            return zstandard.ZstdCompressor(level=3).compress(data)
+        return zlib.compress(data, 6)
+
+    @staticmethod
+    def _decompress(data: bytes, codec: str) -> bytes:
+        if codec == 'zstd':
+            if zstandard is None:
+                raise RuntimeError("Backup chunk is zstd-compressed but zstandard is not installed")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return zlib.decompress(data)
+
+    def _find_object(self, chunk_hash: str) -> Optional[Path]:
+        for codec in ('zstd', 'zlib'):
+            path = self._object_path(chunk_hash, codec)
+            if path.exists():
+                return path
+        return None
+
+    def _write_object(self, chunk_hash: str, data: bytes) -> int:
+        """Stores a chunk unless it already exists. Returns the number of bytes written."""
+        with self.object_lock:
+            existing = self._find_object(chunk_hash)
+            if existing:
+                # Marks the chunk as in use for a prune that may be running
+                os.utime(existing)
+                return 0
+
+        path = self._object_path(chunk_hash, self.codec)
+        path.parent.mkdir(exist_ok=True)
+        compressed = self._compress(data)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(compressed)
+        os.replace(tmp_path, path)
+        return len(compressed)
+
+    def add_backup(self, db_path, name: Optional[str] = None) -> dict:
+        """
+        Stores a backup of db_path and returns its manifest.
+        Only chunks not already in the store are compressed and written.
+        """
+        name = name or f"LocalDB_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+        # Two backups with the same name would overwrite each other's manifest
+        base_name, suffix = name, 1
+        while (self.manifests_path / f"{name}.json").exists():
+            suffix += 1
+            name = f"{base_name}_{suffix}"
+        chunk_size = self.get_page_size(db_path) * self.pages_per_chunk
+
+        file_hash = hashlib.sha256()
+        chunks = []
+        size = 0
+        written = 0
+        with open(db_path, 'rb') as f:
+            for data in iter(lambda: f.read(chunk_size), b''):
+                file_hash.update(data)
+                chunk_hash = hashlib.sha256(data).hexdigest()
+                written += self._write_object(chunk_hash, data)
+                chunks.append(chunk_hash)
+                size += len(data)
+
+        manifest = {
+            "name": name,
+            "created": datetime.now().isoformat(),
+            "size": size,
+            "sha256": file_hash.hexdigest(),
+            "chunk_size": chunk_size,
+            "chunks": chunks
+        }
+        manifest_path = self.manifests_path / f"{name}.json"
+        tmp_path = manifest_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+
+        logger.info("Backup %s stored: %s chunks, %s new bytes", name, len(chunks), written)
+        return manifest
+
+    def list_backups(self) -> List[str]:
+        """Returns backup names, newest first."""
+        return sorted((p.stem for p in self.manifests_path.glob('*.json')), reverse=True)
+
+    def get_manifest(self, name: str) -> dict:
+        manifest_path = self.manifests_path / f"{name}.json"
+        if not manifest_path.exists():
+            raise FileNotFoundError(f"Backup not found: {name}")
+        with open(manifest_path) as f:
+            return json.load(f)
+
+    def restore_backup(self, name: str, dest_path) -> str:
+        """
+        Rebuilds a byte-identical copy of the backup at dest_path.
+        The result is verified against the manifest hash before it is moved into place.
+        """
+        manifest = self.get_manifest(name)
+        dest_path = Path(dest_path)
+        fd, tmp_path = tempfile.mkstemp(dir=dest_path.parent, suffix='.tmp')
+        try:
+            file_hash = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as f:
+                for chunk_hash in manifest['chunks']:
+                    path = self._find_object(chunk_hash)
+                    if path is None:
+                        raise FileNotFoundError(f"Missing chunk {chunk_hash} for backup {name}")
+                    data = self._decompress(path.read_bytes(), path.suffix[1:])
+                    file_hash.update(data)
+                    f.write(data)
+
+            if file_hash.hexdigest() != manifest['sha256']:
+                raise ValueError(f"Restored backup {name} does not match its manifest hash")
+
+            os.replace(tmp_path, dest_path)
+            logger.info("Backup %s restored to %s", name, dest_path)
+            return str(dest_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def prune(self, keep_last: int) -> int:
+        """
+        Removes all but the newest keep_last backups and deletes chunks no manifest references.
+        Safe to run while backups are added. Returns the number of chunks removed.
+        """
+        started = time.time() - PRUNE_GRACE_SECONDS
+        for name in self.list_backups()[keep_last:]:
+            (self.manifests_path / f"{name}.json").unlink()
+            logger.info("Removed old backup: %s", name)
+
+        referenced = set()
+        for name in self.list_backups():
+            referenced.update(self.get_manifest(name)['chunks'])
+
+        removed = 0
+        for path in self.objects_path.glob('*/*'):
+            if path.suffix != '.tmp' and path.name.split('.')[0] in referenced:
+                continue
+            with self.object_lock:
+                try:
+                    # Written or reused by a backup added since the prune started
+                    if path.stat().st_mtime >= started:
+                        continue
+                    path.unlink()
+                except FileNotFoundError:
+                    continue
+            removed += 1
+        return removed
+
+    def get_stats(self) -> dict:
+        """Logical size of all backups versus bytes actually stored."""
+        logical = sum(self.get_manifest(name)['size'] for name in self.list_backups())
+        stored = sum(p.stat().st_size for p in self.objects_path.glob('*/*'))
+        return {
+            "backups": len(self.list_backups()),
+            "logical_bytes": logical,
+            "stored_bytes": stored,
+            "dedupe_ratio": round(logical / stored, 2) if stored else None
+        }
+
+if __name__ == '__main__':
+    import argparse
+    from app.config import DB_DIRECTORY, DB_PATH
+
+    parser = argparse.ArgumentParser(description="Inspect and restore database backups")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list')
+    subparsers.add_parser('stats')
+    restore_parser = subparsers.add_parser('restore')
+    restore_parser.add_argument('name')
+    restore_parser.add_argument('--dest', default=DB_PATH)
+    args = parser.parse_args()
+
+    store = BackupStore(os.path.join(DB_DIRECTORY, 'backups', 'store'))
+    if args.command == 'list':
+        print('\n'.join(store.list_backups()))
+    elif args.command == 'stats':
+        print(json.dumps(store.get_stats(), indent=2))
+    elif args.command == 'restore':
+        print(store.restore_backup(args.name, args.dest))
@@ -1,5 +1,9 @@
 from pathlib import Path
 
+from app.config import MEDIA_HASH_STORE_PATH
+from app.services.library_index.library_index import LibraryIndex, diff_manifest
+from app.services.library_index.hash_store import HashStore
+
 class BookSync:
     def __init__(self, book_library_path):
         self.book_library_path = Path(book_library_path).resolve()
@@ -7,6 +11,7 @@ class BookSync:
 
     def initialize(self):
         self.ensure_folder_exists()
+        self.library_index = LibraryIndex(self.book_library_path, HashStore(MEDIA_HASH_STORE_PATH))
 
     def ensure_folder_exists(self):
         self.book_library_path.mkdir(parents=True, exist_ok=True)
@@ -15,54 +20,84 @@ class BookSync:
         """
         Retrieves a list of all book directories in the book library.
         """
-        try:
-            books = [
-                book.name for book in self.book_library_path.iterdir()
-                if book.is_dir() and not book.name.startswith('.')
-            ]
-            return books
-        except Exception as e:
-            raise e
+        return self.library_index.list_folders()
 
     def book_exists(self, book_name):
         """
         Check if a book exists in the library.
         """
-        book_path = self.book_library_path / book_name
-        return book_path.exists() and book_path.is_dir()
+        try:
+            self.library_index.get_folder(book_name)
+            return True
+        except FileNotFoundError:
+            return False
     
     def get_book_files(self, book_name):
         """
         Retrieves a list of all files within the specified book.
         Each file is represented as a dictionary with 'name' and 'path'.
         """
-        book_path = self.book_library_path / book_name
-        if not book_path.exists() or not book_path.is_dir():
+        try:
+            files = self.library_index.list_files(book_name)
+        except FileNotFoundError:
             raise FileNotFoundError(f"Book not found: {book_name}")
 
+        # exclude the .txt files
+        return [{"name": file["name"], "path": file["path"]} for file in files if not file["name"].endswith(".txt")]
+
+    def get_book_manifest(self, book_name):
+        """
+        Retrieves the files of the specified book with size, mtime and sha256,
+        so the phone can tell which of its local copies are current. sha256 is
+        None for files still being hashed in the background.
+        """
         try:
-            files = [
-                {
-                    "name": file.name,
-                    "path": str(file.resolve())
-                }
-                for file in book_path.iterdir()
-                if file.is_file()
-            ]
+            manifest = self.library_index.get_manifest(book_name)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Book not found: {book_name}")
 
-            # exclude the .txt files
-            return [file for file in files if not file["name"].endswith(".txt")]
-        except Exception as e:
-            raise e
+        # exclude the .txt files
+        return [file for file in manifest if not file["name"].endswith(".txt")]
 
-    def get_file_path(self, book_name, file_name):
+    def diff_book(self, book_name, client_files):
         """
-        Constructs and returns the absolute path to the specified file within a book.
+        Compares the phone's copy of a book ([{name, size, sha256}]) with the server,
+        returning the files to fetch and the names to delete.
         """
-        book_path = self.book_library_path / book_name
-        file_path = book_path / file_name
+        return diff_manifest(self.get_book_manifest(book_name), client_files)
 
-        if not file_path.exists() or not file_path.is_file():
-            raise FileNotFoundError(f"File not found: {file_path}")
+    def get_book_archive(self, book_name, file_names=None):
+        """
+        Returns a streamable tar of the book, or of the chosen files only.
+        """
+        if file_names is None:
+            # exclude the .txt files
+            file_names = [file["name"] for file in self.get_book_files(book_name)]
+        return self.library_index.get_archive(book_name, file_names)
 
-        return file_path.resolve()
+    def get_books_files(self, book_names=None, since=None, cursor=None, limit=100):
+        """
+        Retrieves the file lists of many books in one call: the given books, or
+        all of them a page at a time. With `since` (unix time), only books
+        changed since then are included. Returns the books, the next cursor and
+        the server time to send as the next `since`.
+        """
+        folders, next_cursor, server_time = self.library_index.list_folders_with_files(book_names, since, cursor, limit)
+        books = [
+            {
+                "name": name,
+                "changed_at": folder.changed_at,
+                "files": [
+                    {"name": file["name"], "path": file["path"], "size": file["size"], "mtime": file["mtime_ns"] / 1e9}
+                    for file in folder.files if not file["name"].endswith(".txt")
+                ]
+            }
+            for name, folder in folders
+        ]
+        return books, next_cursor, server_time
+
+    def get_file_path(self, book_name, file_name):
+        """
+        Returns the absolute path to the specified file within a book.
+        """
+        return self.library_index.get_file_path(book_name, file_name)
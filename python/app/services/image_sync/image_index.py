@@ -0,0 +1,412 @@
+import os
+import sqlite3
+import time
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from logger import logger
+from app.services.image_sync import perceptual_hash
+
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp'}
+READ_SIZE = 1024 * 1024
+
+def hash_path(path) -> str:
+    """Calculate SHA-256 of a file on disk without loading it in memory."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+class ImageIndex:
+    """
+    Persistent sha256 -> filename index of the image library.
+
+    One SQLite table maps every image under the `YYYY/MM Month` folders to its
+    hash, size and mtime, so a duplicate check is a single lookup instead of
+    rehashing the whole month folder. A 64-bit perceptual hash is kept next to
+    it for near-duplicate checks, scanned per month as a packed NumPy array. Each folder's mtime is recorded too: if a
+    folder changed outside the server, it is reconciled (only new or modified
+    files are rehashed) before it is queried. For images re-encoded by the
+    server, sha256 and original_size stay those of the upload (what the phone
+    dedupes against) and stored_sha256 / size describe the file on disk.
+    """
+
+    def __init__(self, library_path, index_path):
+        self.library_path = Path(library_path).resolve()
+        self.index_path = index_path
+        self.lock = threading.RLock()
+        self.sequences = {}
+        self.phash_arrays = {}
+        # (folder, filename) of files that could not be decoded for a perceptual hash
+        self.unhashable = set()
+        self.connection = sqlite3.connect(index_path, check_same_thread=False)
+        self.initialize()
+
+    def initialize(self):
+        with self.lock:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS images (
+                    folder TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    phash INTEGER,
+                    added_at REAL NOT NULL DEFAULT 0,
+                    original_size INTEGER,
+                    stored_sha256 TEXT,
+                    PRIMARY KEY (folder, filename)
+                );
+                CREATE INDEX IF NOT EXISTS idx_images_folder_sha256 ON images (folder, sha256);
+                CREATE TABLE IF NOT EXISTS folders (
+                    folder TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS sequences (
+                    folder TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    last_number INTEGER NOT NULL,
+                    PRIMARY KEY (folder, date)
+                );
+            """)
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(images)")]
+            if 'phash' not in columns:
+                self.connection.execute("ALTER TABLE images ADD COLUMN phash INTEGER")
+            if 'added_at' not in columns:
+                self.connection.execute("ALTER TABLE images ADD COLUMN added_at REAL NOT NULL DEFAULT 0")
+            if 'original_size' not in columns:
+                self.connection.execute("ALTER TABLE images ADD COLUMN original_size INTEGER")
+            if 'stored_sha256' not in columns:
+                self.connection.execute("ALTER TABLE images ADD COLUMN stored_sha256 TEXT")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS idx_images_added_at ON images (added_at)")
+            self.connection.commit()
+
+    @staticmethod
+    def is_image(filename: str) -> bool:
+        return '.' in filename and filename.rsplit('.', 1)[1].lower() in IMAGE_EXTENSIONS
+
+    def folder_mtime(self, folder: str) -> Optional[int]:
+        try:
+            return os.stat(self.library_path / folder).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def reconcile(self, folder: str) -> None:
+        """
+        Brings the index of one folder in line with the disk if the folder changed
+        since it was last indexed. Unchanged files (same size and mtime) are not rehashed.
+        """
+        with self.lock:
+            mtime_ns = self.folder_mtime(folder)
+            row = self.connection.execute("SELECT mtime_ns FROM folders WHERE folder = ?", (folder,)).fetchone()
+            if row and row[0] == mtime_ns:
+                return
+
+            indexed = {
+                filename: (size, file_mtime)
+                for filename, size, file_mtime in self.connection.execute(
+                    "SELECT filename, size, mtime_ns FROM images WHERE folder = ?", (folder,)
+                )
+            }
+
+            on_disk = {}
+            if mtime_ns is not None:
+                with os.scandir(self.library_path / folder) as entries:
+                    for entry in entries:
+                        if entry.is_file() and self.is_image(entry.name):
+                            stat = entry.stat()
+                            on_disk[entry.name] = (stat.st_size, stat.st_mtime_ns, entry.path)
+
+            now = time.time()
+            removed = [filename for filename in indexed if filename not in on_disk]
+            changed = [
+                (folder, filename, hash_path(path), size, file_mtime, now)
+                for filename, (size, file_mtime, path) in on_disk.items()
+                if indexed.get(filename) != (size, file_mtime)
+            ]
+
+            self.connection.executemany("DELETE FROM images WHERE folder = ? AND filename = ?", [(folder, f) for f in removed])
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO images (folder, filename, sha256, size, mtime_ns, added_at) VALUES (?, ?, ?, ?, ?, ?)", changed
+            )
+            if mtime_ns is None:
+                self.connection.execute("DELETE FROM folders WHERE folder = ?", (folder,))
+            else:
+                self.connection.execute("INSERT OR REPLACE INTO folders VALUES (?, ?)", (folder, mtime_ns))
+            self.connection.commit()
+
+            if removed or changed:
+                self.phash_arrays.pop(folder, None)
+                self.unhashable.difference_update((folder, row[1]) for row in changed)
+                self.unhashable.difference_update((folder, filename) for filename in removed)
+                logger.info(f"Reconciled image index for {folder}: {len(changed)} indexed, {len(removed)} removed")
+
+    def lookup(self, folder: str, sha256: str) -> Optional[str]:
+        """Returns the filename of an image with this hash in the folder, if any."""
+        with self.lock:
+            self.reconcile(folder)
+            row = self.connection.execute(
+                "SELECT filename FROM images WHERE folder = ? AND sha256 = ? LIMIT 1", (folder, sha256)
+            ).fetchone()
+            return row[0] if row else None
+
+    def get_sha256(self, folder: str, filename: str) -> Optional[str]:
+        """Returns the hash of one library image, or None if it is not in the folder."""
+        with self.lock:
+            self.reconcile(folder)
+            row = self.connection.execute(
+                "SELECT sha256 FROM images WHERE folder = ? AND filename = ?", (folder, filename)
+            ).fetchone()
+            return row[0] if row else None
+
+    def lookup_many(self, folder: str, sha256s: Iterable[str]) -> Dict[str, Tuple[str, int]]:
+        """
+        Returns {sha256: (filename, size)} for the hashes the folder already holds.
+        The size is the uploaded one, also for images re-encoded since.
+        """
+        sha256s = list(set(sha256s))
+        found = {}
+        with self.lock:
+            self.reconcile(folder)
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(sha256s), 500):
+                batch = sha256s[start:start + 500]
+                rows = self.connection.execute(
+                    f"SELECT sha256, filename, COALESCE(original_size, size) FROM images WHERE folder = ? AND sha256 IN ({','.join('?' for _ in batch)})",
+                    (folder, *batch)
+                )
+                for sha256, filename, size in rows:
+                    found.setdefault(sha256, (filename, size))
+        return found
+
+    def ensure_phashes(self, folder: str) -> None:
+        """
+        Computes the perceptual hashes the folder is missing (files added outside
+        the server, or indexed before hashes were kept). Images are decoded
+        without holding the lock, so lookups and adds don't wait for it.
+        """
+        if not perceptual_hash.is_available():
+            return
+        with self.lock:
+            self.reconcile(folder)
+            missing = [
+                filename for (filename,) in self.connection.execute(
+                    "SELECT filename FROM images WHERE folder = ? AND phash IS NULL", (folder,)
+                )
+                if (folder, filename) not in self.unhashable
+            ]
+        if not missing:
+            return
+
+        updates = []
+        for filename in missing:
+            phash = perceptual_hash.compute_dhash(self.library_path / folder / filename)
+            if phash is None:
+                self.unhashable.add((folder, filename))
+            else:
+                updates.append((phash, folder, filename))
+        if not updates:
+            return
+
+        with self.lock:
+            self.connection.executemany(
+                "UPDATE images SET phash = ? WHERE folder = ? AND filename = ? AND phash IS NULL", updates
+            )
+            self.connection.commit()
+            self.phash_arrays.pop(folder, None)
+        logger.info(f"Computed {len(updates)} perceptual hashes for {folder}")
+
+    def _load_phashes(self, folder: str):
+        """Returns (filenames, int64 array) of the folder's known perceptual hashes, cached per folder."""
+        if folder in self.phash_arrays:
+            return self.phash_arrays[folder]
+
+        rows = self.connection.execute(
+            "SELECT filename, phash FROM images WHERE folder = ? AND phash IS NOT NULL", (folder,)
+        ).fetchall()
+        filenames = [filename for filename, _ in rows]
+        hashes = perceptual_hash.np.fromiter((phash for _, phash in rows), dtype=perceptual_hash.np.int64, count=len(rows))
+        self.phash_arrays[folder] = (filenames, hashes)
+        return self.phash_arrays[folder]
+
+    def find_similar(self, folder: str, phash: Optional[int], threshold: int) -> Optional[str]:
+        """
+        Returns the filename of the closest image in the folder whose perceptual hash is
+        within `threshold` bits of `phash`, if any. A negative threshold disables the check.
+        Only images with a known hash are compared: call ensure_phashes first, outside the lock.
+        """
+        if phash is None or threshold < 0 or not perceptual_hash.is_available():
+            return None
+        with self.lock:
+            self.reconcile(folder)
+            filenames, hashes = self._load_phashes(folder)
+            if not filenames:
+                return None
+            distances = perceptual_hash.hamming_distances(hashes, phash)
+            best = int(distances.argmin())
+            return filenames[best] if distances[best] <= threshold else None
+
+    def add(self, folder: str, filename: str, sha256: str, phash: Optional[int] = None,
+            previous_folder_mtime_ns: Optional[int] = None) -> None:
+        """
+        Records an image the server just wrote, so it is not rehashed on the next lookup.
+        previous_folder_mtime_ns is the folder's mtime from just before the write: if the
+        index was in sync with it, the write is the only change and the folder isn't rescanned.
+        """
+        with self.lock:
+            stat = os.stat(self.library_path / folder / filename)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO images (folder, filename, sha256, size, mtime_ns, phash, added_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (folder, filename, sha256, stat.st_size, stat.st_mtime_ns, phash, time.time())
+            )
+            if previous_folder_mtime_ns is not None:
+                self.connection.execute(
+                    "UPDATE folders SET mtime_ns = ? WHERE folder = ? AND mtime_ns = ?",
+                    (self.folder_mtime(folder), folder, previous_folder_mtime_ns)
+                )
+            self.connection.commit()
+            if folder in self.phash_arrays:
+                filenames, hashes = self.phash_arrays[folder]
+                if filename in filenames or phash is None:
+                    del self.phash_arrays[folder]
+                else:
+                    self.phash_arrays[folder] = (filenames + [filename], perceptual_hash.np.append(hashes, perceptual_hash.np.int64(phash)))
+            # Rescans only if the folder changed outside the server too
+            self.reconcile(folder)
+
+    def replace_file(self, folder: str, filename: str, new_filename: str, stored_sha256: Optional[str] = None) -> None:
+        """
+        Records that an image was re-encoded (stored_sha256 is the new file's hash)
+        and/or renamed by the server. The row keeps the upload's sha256 and
+        perceptual hash, so re-sending the original is still caught as a duplicate;
+        the first stored size is kept as original_size for lookups and storage
+        reporting. Call with the lock held, right after the swap.
+        """
+        with self.lock:
+            stat = os.stat(self.library_path / folder / new_filename)
+            self.connection.execute(
+                """
+                UPDATE images SET filename = ?, original_size = COALESCE(original_size, size), size = ?, mtime_ns = ?,
+                    stored_sha256 = COALESCE(?, stored_sha256), added_at = ?
+                WHERE folder = ? AND filename = ?
+                """,
+                (new_filename, stat.st_size, stat.st_mtime_ns, stored_sha256, time.time(), folder, filename)
+            )
+            self.connection.commit()
+            self.phash_arrays.pop(folder, None)
+            self.reconcile(folder)
+
+    def get_recompression_stats(self) -> dict:
+        """Storage saved by server-side recompression, over the whole library."""
+        with self.lock:
+            count, original, stored = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(original_size), 0), COALESCE(SUM(size), 0) FROM images WHERE original_size IS NOT NULL"
+            ).fetchone()
+        return {
+            "recompressed_images": count,
+            "original_bytes": original,
+            "stored_bytes": stored,
+            "saved_bytes": original - stored
+        }
+
+    def _seed_sequence(self, folder: str, date_str: str) -> int:
+        row = self.connection.execute(
+            "SELECT last_number FROM sequences WHERE folder = ? AND date = ?", (folder, date_str)
+        ).fetchone()
+        if row:
+            return row[0]
+
+        # First use for this date: one directory scan
+        last_number = 0
+        prefix = f"{date_str}_"
+        try:
+            with os.scandir(self.library_path / folder) as entries:
+                for entry in entries:
+                    stem = entry.name.rsplit('.', 1)[0]
+                    if stem.startswith(prefix) and stem[len(prefix):].isdigit():
+                        last_number = max(last_number, int(stem[len(prefix):]))
+        except FileNotFoundError:
+            pass
+        return last_number
+
+    def next_number(self, folder: str, date_str: str) -> int:
+        """
+        Hands out the next `{date}_{n}` number for a folder. Numbers are allocated under
+        the index lock, so concurrent uploads for the same date never get the same one.
+        The counter is persisted and committed with the next index write.
+        """
+        with self.lock:
+            key = (folder, date_str)
+            if key not in self.sequences:
+                self.sequences[key] = self._seed_sequence(folder, date_str)
+            self.sequences[key] += 1
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sequences VALUES (?, ?, ?)", (folder, date_str, self.sequences[key])
+            )
+            return self.sequences[key]
+
+    def reconcile_all(self) -> None:
+        """
+        Reconciles every YYYY/MM folder; unchanged folders cost one stat each.
+        The lock is taken per folder, not for the whole walk, so uploads and
+        lookups run in between.
+        """
+        for year in sorted(p for p in self.library_path.iterdir() if p.is_dir() and not p.name.startswith('.')):
+            for month in sorted(p for p in year.iterdir() if p.is_dir()):
+                self.reconcile(f"{year.name}/{month.name}")
+
+    def list_images(self, after: Optional[Tuple[str, str]] = None, since: Optional[float] = None, limit: int = 500) -> List[tuple]:
+        """
+        One page of the library ordered by (folder, filename), starting after the
+        given key. `since` keeps only images indexed after that unix time.
+        Returns (folder, filename, sha256, size, added_at) tuples describing the
+        file as stored, i.e. after any server-side re-encoding.
+        """
+        query = "SELECT folder, filename, COALESCE(stored_sha256, sha256), size, added_at FROM images WHERE 1 = 1"
+        params = []
+        if after:
+            query += " AND (folder, filename) > (?, ?)"
+            params.extend(after)
+        if since is not None:
+            query += " AND added_at > ?"
+            params.append(since)
+        query += " ORDER BY folder, filename LIMIT ?"
+        params.append(limit)
+
+        with self.lock:
+            return self.connection.execute(query, params).fetchall()
+
+    def rebuild(self) -> int:
+        """Drops the index and rehashes every image folder. Returns the number of images indexed."""
+        with self.lock:
+            self.connection.execute("DELETE FROM images")
+            self.connection.execute("DELETE FROM folders")
+            self.connection.execute("DELETE FROM sequences")
+            self.connection.commit()
+            self.sequences.clear()
+            self.phash_arrays.clear()
+            self.reconcile_all()
+
+            (count,) = self.connection.execute("SELECT COUNT(*) FROM images").fetchone()
+            logger.info(f"Rebuilt image index: {count} images")
+            return count
+
+if __name__ == '__main__':
+    import argparse
+    from app.config import IMAGE_LIBRARY_PATH, IMAGE_INDEX_PATH
+
+    parser = argparse.ArgumentParser(description="Maintain the image library hash index")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('rebuild')
+    subparsers.add_parser('stats')
+    args = parser.parse_args()
+
+    if args.command == 'rebuild':
+        print(f"Indexed {ImageIndex(IMAGE_LIBRARY_PATH, IMAGE_INDEX_PATH).rebuild()} images")
+    elif args.command == 'stats':
+        stats = ImageIndex(IMAGE_LIBRARY_PATH, IMAGE_INDEX_PATH).get_recompression_stats()
+        print(f"Recompressed {stats['recompressed_images']} images: {stats['original_bytes']:,} -> {stats['stored_bytes']:,} bytes, "
+              f"{stats['saved_bytes']:,} saved")
@@ -1,11 +1,54 @@
 import os
+import re
+import time
+import json
+import base64
 from datetime import datetime
 from pathlib import Path
 import hashlib
-from typing import Tuple, List
+import tempfile
+import multiprocessing
+from typing import Tuple, List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from logger import logger
-from app.config import IMAGE_LIBRARY_PATH
+from app.config import (
+    IMAGE_LIBRARY_PATH,
+    IMAGE_INDEX_PATH,
+    IMAGE_NEAR_DUPLICATE_THRESHOLD,
+    THUMBNAIL_CACHE_PATH,
+    THUMBNAIL_CACHE_MAX_BYTES,
+    IMAGE_RECOMPRESS,
+    IMAGE_MAX_DIMENSION,
+    IMAGE_RECOMPRESS_QUALITY,
+    IMAGE_RECOMPRESS_FORMAT
+)
+from app.services.image_sync.image_index import ImageIndex
+from app.services.image_sync.perceptual_hash import compute_dhash
+from app.services.image_sync.thumbnails import ThumbnailCache
+from app.services.image_sync import recompress
+
+# Initialize ImageIndex
+image_index = ImageIndex(IMAGE_LIBRARY_PATH, IMAGE_INDEX_PATH)
+
+# Initialize ThumbnailCache
+thumbnail_cache = ThumbnailCache(THUMBNAIL_CACHE_PATH, THUMBNAIL_CACHE_MAX_BYTES)
+
+# Created on first use, only when recompression is enabled
+recompress_executor = None
+
+READ_SIZE = 1024 * 1024
+# Uploads are staged here, not in the month folder, so writing them doesn't change the folder mtime
+# (which makes the image index rescan it). Same file system as the library, so they can be linked in.
+STAGING_PATH = Path(IMAGE_LIBRARY_PATH) / '.staging'
+STAGING_MAX_AGE_SECONDS = 24 * 60 * 60
+# Uploads are I/O bound (disk writes, hashlib releases the GIL), a few threads are enough
+IMAGE_INGEST_WORKERS = 4
+MANIFEST_PAGE_SIZE = 500
+MANIFEST_MAX_PAGE_SIZE = 2000
+# Re-encoding is CPU bound, it gets processes so it never competes with request threads
+IMAGE_RECOMPRESS_WORKERS = 2
+DATED_FILENAME = re.compile(r'^(\d{4}-\d{2}-\d{2})_')
 
 def get_month_name(date_str: str) -> Tuple[str, str]:
     """Get year/month folder path and full month name from date string."""
@@ -21,67 +64,275 @@ def get_month_name(date_str: str) -> Tuple[str, str]:
 
 def get_next_filename(folder_path: str, date_str: str) -> str:
     """Get next available filename for the given date."""
+    return f"{date_str}_{image_index.next_number(folder_path, date_str)}.jpg"
+
+def clean_staging() -> None:
+    """Removes staged uploads left behind by a crash."""
+    STAGING_PATH.mkdir(parents=True, exist_ok=True)
+    cutoff = time.time() - STAGING_MAX_AGE_SECONDS
+    for entry in os.scandir(STAGING_PATH):
+        try:
+            if entry.name.endswith('.upload') and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+def write_temp_file(image) -> Tuple[str, str]:
+    """
+    Streams an upload to a temp file in the staging folder in fixed-size chunks,
+    hashing it on the way. Returns the temp path and the SHA-256.
+    """
+    sha = hashlib.sha256()
+    STAGING_PATH.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=STAGING_PATH, suffix='.upload')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: image.stream.read(READ_SIZE), b''):
+                sha.update(chunk)
+                f.write(chunk)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, sha.hexdigest()
+
+def claim_file(tmp_path: str, dest: Path) -> None:
+    """
+    Puts a staged upload at dest, raising FileExistsError if dest is taken.
+    Hardlinks where possible; on file systems without hardlinks (exFAT, some
+    network mounts) dest is reserved with an exclusive create and the staged
+    file is renamed over it.
+    """
+    try:
+        os.link(tmp_path, dest)
+        return
+    except FileExistsError:
+        raise
+    except OSError:
+        pass
+
+    os.close(os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+    try:
+        os.replace(tmp_path, dest)
+    except OSError:
+        os.remove(dest)
+        raise
+
+def ingest_image(image, folder_path: str, date_str: str) -> Tuple[bool, str]:
+    """
+    Writes one upload into the folder in a single pass.
+    Returns (True, existing path) for an exact or near-duplicate, (False, saved path) otherwise.
+    """
     folder = Path(IMAGE_LIBRARY_PATH) / folder_path
     folder.mkdir(parents=True, exist_ok=True)
+    tmp_path, sha = write_temp_file(image)
+
+    try:
+        # Decoding happens outside the lock so pool workers don't queue behind it
+        phash = None
+        if IMAGE_NEAR_DUPLICATE_THRESHOLD >= 0:
+            phash = compute_dhash(tmp_path)
+            image_index.ensure_phashes(folder_path)
+
+        # Lookup, naming and indexing are one step so concurrent uploads can't both save the same image
+        with image_index.lock:
+            existing_filename = (
+                image_index.lookup(folder_path, sha)
+                or image_index.find_similar(folder_path, phash, IMAGE_NEAR_DUPLICATE_THRESHOLD)
+            )
+            if existing_filename:
+                return True, str(folder / existing_filename)
+
+            folder_mtime_ns = image_index.folder_mtime(folder_path)
+            while True:
+                filename = get_next_filename(folder_path, date_str)
+                try:
+                    claim_file(tmp_path, folder / filename)
+                    break
+                except FileExistsError:
+                    # Taken by a file written outside the server, move on to the next number
+                    continue
+            image_index.add(folder_path, filename, sha, phash, folder_mtime_ns)
+        thumbnail_cache.submit(folder / filename, sha)
+        schedule_recompression(folder_path, filename)
+        return False, str(folder / filename)
+    finally:
+        # Already gone if it was renamed into place
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def get_recompress_executor() -> ProcessPoolExecutor:
+    global recompress_executor
+    if recompress_executor is None:
+        # Not fork: copying a multithreaded server can copy locks (logging, sqlite) held by other threads.
+        # Workers only import the recompress module, which doesn't load the app.
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        context = multiprocessing.get_context(method)
+        recompress_executor = ProcessPoolExecutor(max_workers=IMAGE_RECOMPRESS_WORKERS, mp_context=context)
+    return recompress_executor
+
+def schedule_recompression(folder_path: str, filename: str) -> None:
+    """Queues a saved image for background re-encoding, if enabled. The upload doesn't wait for it."""
+    if not IMAGE_RECOMPRESS or not recompress.is_available():
+        return
+
+    source_path = os.path.join(IMAGE_LIBRARY_PATH, folder_path, filename)
+    future = get_recompress_executor().submit(
+        recompress.recompress_image, source_path, IMAGE_MAX_DIMENSION, IMAGE_RECOMPRESS_QUALITY, IMAGE_RECOMPRESS_FORMAT
+    )
+    future.add_done_callback(lambda f: apply_recompression(folder_path, filename, f))
+
+def apply_recompression(folder_path: str, filename: str, future) -> None:
+    """Swaps a re-encoded (or renamed) image into place and updates the index, under the index lock."""
+    try:
+        result = future.result()
+    except Exception as e:
+        logger.error(f"Failed to recompress image {filename}: {e}")
+        return
+    if result is None:
+        return
 
-    existing_files = [f for f in folder.glob(f"{date_str}_*.jpg")]
-    numbers = [int(f.stem.split('_')[-1]) for f in existing_files if f.stem.split('_')[-1].isdigit()]
-    next_number = max(numbers, default=0) + 1
-    
-    return f"{date_str}_{next_number}.jpg"
-
-def get_image_hash(image) -> str:
-    """Calculate SHA-256 hash of image content."""
-    image.seek(0)  # Reset file pointer to beginning
-    content = image.read()
-    image.seek(0)  # Reset file pointer again for later use
-    return hashlib.sha256(content).hexdigest()
-
-def is_duplicate(image, folder_path: str) -> Tuple[bool, str]:
-    """Check if image is duplicate in the given folder."""
-    current_hash = get_image_hash(image)
     folder = Path(IMAGE_LIBRARY_PATH) / folder_path
-    
-    if not folder.exists():
-        return False, ""
-    
-    for existing_file in folder.glob("*.jpg"):
-        with open(existing_file, 'rb') as f:
-            if current_hash == hashlib.sha256(f.read()).hexdigest():
-                return True, str(existing_file)
-    return False, ""
+    old_path = folder / filename
+    new_path = folder / result['filename']
+    try:
+        with image_index.lock:
+            if not old_path.exists() or (new_path != old_path and new_path.exists()):
+                logger.error(f"Skipped recompression of {filename}: the file moved or {new_path.name} is taken")
+                return
+
+            if result['tmp_path']:
+                os.replace(result['tmp_path'], new_path)
+                if new_path != old_path:
+                    os.remove(old_path)
+            else:
+                os.rename(old_path, new_path)
+            image_index.replace_file(folder_path, filename, new_path.name, result['sha256'])
+    finally:
+        if result['tmp_path'] and os.path.exists(result['tmp_path']):
+            os.remove(result['tmp_path'])
+
+    logger.info(f"Recompressed {filename} -> {new_path.name}: {result['original_size']:,} -> {result['new_size']:,} bytes")
+
+def get_thumbnail(image_path: str) -> Tuple[Path, str]:
+    """
+    Returns the thumbnail of a library image given as 'YYYY/MM Month/file.jpg',
+    and its cache key. Raises FileNotFoundError if the image isn't in the library.
+    """
+    folder = Path(IMAGE_LIBRARY_PATH).resolve()
+    source_path = (folder / image_path).resolve()
+    if folder not in source_path.parents or not source_path.is_file():
+        raise FileNotFoundError(f"Image not found: {image_path}")
+
+    relative = source_path.relative_to(folder)
+    sha = image_index.get_sha256(relative.parent.as_posix(), relative.name)
+    if sha is None:
+        raise FileNotFoundError(f"Image not found: {image_path}")
+
+    thumb_path = thumbnail_cache.get(source_path, sha)
+    if thumb_path is None:
+        raise RuntimeError("Thumbnails need Pillow")
+    return thumb_path, thumbnail_cache.get_key(sha)
+
+def encode_cursor(folder: str, filename: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([folder, filename]).encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        folder, filename = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return folder, filename
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def get_manifest(cursor: Optional[str] = None, since: Optional[float] = None, limit: int = MANIFEST_PAGE_SIZE) -> Tuple[List[dict], Optional[str]]:
+    """
+    One page of the image library from the index, ordered by folder and filename.
+    Returns the images and the cursor of the next page (None on the last page).
+    """
+    if cursor is None:
+        # Pick up folders changed outside the server once per listing, not per page
+        image_index.reconcile_all()
 
-def save_images(date_str: str, images) -> Tuple[List[str], int]:
+    limit = max(1, min(limit, MANIFEST_MAX_PAGE_SIZE))
+    rows = image_index.list_images(decode_cursor(cursor) if cursor else None, since, limit + 1)
+
+    images = []
+    for folder, filename, sha, size, added_at in rows[:limit]:
+        match = DATED_FILENAME.match(filename)
+        images.append({
+            "path": f"{folder}/{filename}",
+            "date": match.group(1) if match else None,
+            "filename": filename,
+            "size": size,
+            "sha256": sha,
+            "added_at": added_at
+        })
+
+    next_cursor = encode_cursor(*rows[limit - 1][:2]) if len(rows) > limit else None
+    return images, next_cursor
+
+def find_existing_images(entries: List[dict]) -> List[bool]:
+    """
+    Answers, for each {date, sha256, size} the phone is about to upload, whether
+    the server already holds that image in the date's month folder.
+    One index query per month folder, no image is read.
+    """
+    by_folder: Dict[str, List[int]] = {}
+    for i, entry in enumerate(entries):
+        folder_path, _ = get_month_name(entry['date'])
+        by_folder.setdefault(folder_path, []).append(i)
+
+    known = [False] * len(entries)
+    for folder_path, indices in by_folder.items():
+        found = image_index.lookup_many(folder_path, (entries[i]['sha256'].lower() for i in indices))
+        for i in indices:
+            match = found.get(entries[i]['sha256'].lower())
+            size = entries[i].get('size')
+            known[i] = match is not None and (size is None or match[1] == size)
+    return known
+
+def save_image(image, folder_path: str, date_str: str) -> Tuple[str, str]:
+    """Saves one upload. Returns ('saved' | 'duplicate' | 'skipped', path)."""
+    try:
+        if not allowed_file(image.filename):
+            logger.error(f"Unsupported file type: {image.filename}")
+            return 'skipped', ""
+
+        is_dup, path = ingest_image(image, folder_path, date_str)
+        if is_dup:
+            logger.info(f"Duplicate image found: {path}")
+            return 'duplicate', path
+
+        logger.info(f"Saved image to: {path}")
+        return 'saved', path
+    except Exception as e:
+        logger.error(f"Failed to save image {image.filename}: {e}")
+        return 'skipped', ""
+
+def save_images(date_str: str, images, max_workers: int = IMAGE_INGEST_WORKERS) -> Tuple[List[str], int]:
+    """
+    Saves a batch of uploads for one date. Images are hashed and written on a
+    bounded thread pool; naming and indexing stay serialized by the index lock.
+    Saved paths are returned in upload order.
+    """
     saved_images = []
     duplicates = 0
     
     folder_path, _ = get_month_name(date_str)
+    images = list(images)
     
-    for image in images:
-        try:
-            if not allowed_file(image.filename):
-                logger.error(f"Unsupported file type: {image.filename}")
-                continue
-            
-            # Check for duplicates
-            is_dup, existing_path = is_duplicate(image, folder_path)
-            if is_dup:
-                logger.info(f"Duplicate image found: {existing_path}")
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(images)))) as executor:
+        results = executor.map(lambda image: save_image(image, folder_path, date_str), images)
+        for status, path in results:
+            if status == 'saved':
+                saved_images.append(path)
+            elif status == 'duplicate':
                 duplicates += 1
-                continue
-                
-            filename = get_next_filename(folder_path, date_str)
-            save_path = os.path.join(IMAGE_LIBRARY_PATH, folder_path, filename)
-            os.makedirs(os.path.dirname(save_path), exist_ok=True)
-            
-            image.save(save_path)
-            logger.info(f"Saved image to: {save_path}")
-            saved_images.append(save_path)
-        except Exception as e:
-            logger.error(f"Failed to save image {image.filename}: {e}")
     
     return saved_images, duplicates
 
 def allowed_file(filename):
     allowed_extensions = {'jpg', 'jpeg', 'png', 'gif'}
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
\ No newline at end of file
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
+
+# Staged uploads left behind by a crash
+clean_staging()
@@ -0,0 +1,46 @@
+from typing import Optional
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HASH_SIZE = 8
+
+def is_available() -> bool:
+    return Image is not None and np is not None
+
+def to_signed(value: int) -> int:
+    """SQLite integers are signed 64-bit, store the hash bits as such."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def compute_dhash(path) -> Optional[int]:
+    """
+    64-bit difference hash: the image is shrunk to 9x8 greyscale and each bit
+    records whether a pixel is brighter than its right neighbour. Re-encoded,
+    resized or recompressed copies of a photo land within a few bits.
+    Returns None if Pillow is missing or the file is not a readable image.
+    """
+    if not is_available():
+        return None
+    try:
+        with Image.open(path) as image:
+            image.draft('L', (HASH_SIZE * 4, HASH_SIZE * 4))  # JPEG: decode at reduced scale
+            pixels = np.asarray(image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS), dtype=np.int16)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return to_signed(int(np.packbits(bits).view('>u8')[0]))
+
+def hamming_distances(hashes, target: int):
+    """Vectorized Hamming distance between a packed int64 array of hashes and one hash."""
+    diff = hashes.view(np.uint64) ^ np.array(target, dtype=np.int64).view(np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(diff)
+    return np.unpackbits(diff.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
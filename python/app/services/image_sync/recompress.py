@@ -0,0 +1,73 @@
+import os
+import hashlib
+from typing import Optional
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Pillow format name -> library file extension
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+READ_SIZE = 1024 * 1024
+
+def is_available() -> bool:
+    return Image is not None
+
+def hash_path(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def recompress_image(path: str, max_dimension: int, quality: int, target_format: str = 'JPEG') -> Optional[dict]:
+    """
+    Re-encodes one library image if it is larger than max_dimension, and finds
+    the extension matching its real format (phones send PNGs that get saved as .jpg).
+
+    Runs in a worker process, so this module stays import-light and only
+    touches the file system: the result is written beside the original as a
+    hidden temp file, and the caller swaps it into place and updates the index.
+    Returns None if nothing needs doing, otherwise {tmp_path, sha256 (both None
+    for a rename only), filename, original_size, new_size}.
+    """
+    folder, filename = os.path.split(path)
+    stem = filename.rsplit('.', 1)[0]
+    original_size = os.path.getsize(path)
+
+    with Image.open(path) as image:
+        actual_format = image.format
+        oversized = max(image.size) > max_dimension
+        # Animations would lose their frames
+        animated = getattr(image, 'is_animated', False)
+
+        if oversized and not animated:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+            if target_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+
+            tmp_path = os.path.join(folder, f".{filename}.recompressed")
+            image.save(tmp_path, target_format, quality=quality)
+            new_size = os.path.getsize(tmp_path)
+            if new_size < original_size:
+                return {
+                    "tmp_path": tmp_path,
+                    "sha256": hash_path(tmp_path),
+                    "filename": f"{stem}.{EXTENSIONS[target_format]}",
+                    "original_size": original_size,
+                    "new_size": new_size
+                }
+            os.remove(tmp_path)
+
+    expected_filename = f"{stem}.{EXTENSIONS.get(actual_format, filename.rsplit('.', 1)[-1])}"
+    if expected_filename.lower() != filename.lower():
+        return {
+            "tmp_path": None,
+            "sha256": None,
+            "filename": expected_filename,
+            "original_size": original_size,
+            "new_size": original_size
+        }
+    return None
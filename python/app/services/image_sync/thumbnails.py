@@ -0,0 +1,149 @@
+import os
+import time
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from logger import logger
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+THUMBNAIL_SIZE = 320
+THUMBNAIL_WORKERS = 2
+# Thumbnails served or made this recently are never evicted, so a path handed out is still there when it's sent
+EVICTION_GRACE_SECONDS = 60
+
+class ThumbnailCache:
+    """
+    Fixed-size thumbnails of the image library.
+
+    Thumbnails are keyed by the original's SHA-256, so a renamed or re-uploaded
+    photo reuses its thumbnail and the key doubles as an ETag. They are made in
+    a small worker pool right after ingest, or in the requesting thread on a
+    miss (so a gallery doesn't wait behind an upload backlog), and stored as
+    WebP (JPEG if Pillow lacks WebP) under aa/<sha>-<size>.<ext>. When the
+    cache outgrows max_bytes, the least recently served thumbnails are evicted,
+    except those served in the last EVICTION_GRACE_SECONDS.
+    """
+
+    def __init__(self, cache_path, max_bytes: int, size: int = THUMBNAIL_SIZE, workers: int = THUMBNAIL_WORKERS):
+        self.cache_path = Path(cache_path).resolve()
+        self.max_bytes = max_bytes
+        self.size = size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnails')
+        self.lock = threading.Lock()
+        self.total_bytes = 0
+        self.initialize()
+
+    def initialize(self):
+        self.cache_path.mkdir(parents=True, exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self._entries())
+
+    @staticmethod
+    def is_available() -> bool:
+        return Image is not None
+
+    @property
+    def format(self) -> str:
+        return 'webp' if Image is not None and features.check('webp') else 'jpeg'
+
+    @property
+    def mimetype(self) -> str:
+        return f"image/{self.format}"
+
+    def get_key(self, sha256: str) -> str:
+        return f"{sha256}-{self.size}"
+
+    def get_path(self, sha256: str) -> Path:
+        extension = 'webp' if self.format == 'webp' else 'jpg'
+        return self.cache_path / sha256[:2] / f"{self.get_key(sha256)}.{extension}"
+
+    def _entries(self):
+        """Yields (path, size, mtime) for every cached thumbnail."""
+        for shard in os.scandir(self.cache_path):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.is_file() and not entry.name.endswith('.tmp'):
+                        stat = entry.stat()
+                        yield entry.path, stat.st_size, stat.st_mtime
+
+    def _render(self, source_path, sha256: str) -> Path:
+        thumb_path = self.get_path(sha256)
+        if thumb_path.exists():
+            return thumb_path
+
+        with Image.open(source_path) as image:
+            image.draft('RGB', (self.size, self.size))  # JPEG: decode at reduced scale
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            image.thumbnail((self.size, self.size), Image.LANCZOS)
+
+            thumb_path.parent.mkdir(exist_ok=True)
+            tmp_path = thumb_path.with_name(thumb_path.name + f".{threading.get_ident()}.tmp")
+            image.save(tmp_path, self.format.upper(), quality=80)
+        os.replace(tmp_path, thumb_path)
+
+        with self.lock:
+            self.total_bytes += thumb_path.stat().st_size
+            over_budget = self.total_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+        return thumb_path
+
+    def submit(self, source_path, sha256: str) -> None:
+        """Renders a thumbnail in the background, used right after ingest."""
+        if not self.is_available():
+            return
+
+        def render():
+            try:
+                self._render(source_path, sha256)
+            except Exception as e:
+                logger.error(f"Failed to create thumbnail for {source_path}: {e}")
+
+        self.executor.submit(render)
+
+    def get(self, source_path, sha256: str) -> Optional[Path]:
+        """
+        Returns the thumbnail path, rendering it inline on a miss. None without Pillow.
+        The thumbnail is safe from eviction for EVICTION_GRACE_SECONDS afterwards.
+        """
+        if not self.is_available():
+            return None
+
+        thumb_path = self.get_path(sha256)
+        try:
+            # The mtime records the last time a thumbnail was served, for eviction
+            os.utime(thumb_path)
+        except FileNotFoundError:
+            thumb_path = self._render(source_path, sha256)
+        return thumb_path
+
+    def evict(self) -> int:
+        """
+        Deletes least recently served thumbnails until the cache is under 90% of
+        max_bytes, sparing those served in the last EVICTION_GRACE_SECONDS.
+        """
+        with self.lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * 0.9
+            grace_cutoff = time.time() - EVICTION_GRACE_SECONDS
+            removed = 0
+            for path, size, mtime in entries:
+                if total <= target or mtime >= grace_cutoff:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+            self.total_bytes = total
+
+        if removed:
+            logger.info(f"Evicted {removed} thumbnails, cache is now {total / (1024 * 1024):.1f} MB")
+        return removed
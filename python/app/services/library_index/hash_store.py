@@ -0,0 +1,137 @@
+import os
+import queue
+import sqlite3
+import hashlib
+import threading
+from typing import Iterable, Optional
+
+from logger import logger
+
+READ_SIZE = 1024 * 1024
+
+class HashStore:
+    """
+    Sidecar cache of file content hashes, kept outside the library.
+
+    A hash is keyed by the file's (device, inode, size, mtime), so it is computed
+    once and recomputed only when the file is replaced or edited. Rows of files
+    that no longer exist are harmless and are dropped by prune(). Files can be
+    queued to be hashed on a background thread with request_hashes().
+    """
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.queue = queue.Queue()
+        self.worker = None
+        self.connection = sqlite3.connect(store_path, check_same_thread=False, timeout=30)
+        self.initialize()
+
+    def initialize(self):
+        with self.lock:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS hashes (
+                    device INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    PRIMARY KEY (device, inode, size, mtime_ns)
+                )
+            """)
+            self.connection.commit()
+
+    @staticmethod
+    def _hash_file(path) -> str:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(READ_SIZE), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    @staticmethod
+    def _key(stat: os.stat_result) -> tuple:
+        return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def lookup_hash(self, path, stat: Optional[os.stat_result] = None) -> Optional[str]:
+        """SHA-256 of a file if the store has it for its current inode, size and mtime, else None. Never reads the file."""
+        stat = stat or os.stat(path)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT sha256 FROM hashes WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?", self._key(stat)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_hash(self, path, stat: Optional[os.stat_result] = None) -> str:
+        """SHA-256 of a file, from the store when its inode, size and mtime are unchanged."""
+        stat = stat or os.stat(path)
+        key = self._key(stat)
+        sha = self.lookup_hash(path, stat)
+        if sha:
+            return sha
+
+        # Hashed outside the lock, other requests keep being served from the store
+        sha = self._hash_file(path)
+        with self.lock:
+            # An older version of the same inode is superseded
+            self.connection.execute("DELETE FROM hashes WHERE device = ? AND inode = ?", key[:2])
+            self.connection.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)", (*key, sha))
+            self.connection.commit()
+        return sha
+
+    def request_hashes(self, paths: Iterable[str]) -> None:
+        """Queues files to be hashed in the background. Files already queued are not queued again."""
+        with self.lock:
+            paths = [path for path in paths if path not in self.pending]
+            self.pending.update(paths)
+            if paths and (self.worker is None or not self.worker.is_alive()):
+                self.worker = threading.Thread(target=self._hash_pending, daemon=True)
+                self.worker.start()
+        for path in paths:
+            self.queue.put(path)
+
+    def _hash_pending(self):
+        while True:
+            path = self.queue.get()
+            try:
+                self.get_hash(path)
+            except OSError as e:
+                # Removed or unreadable since it was queued, it is queued again if it is asked for
+                logger.warning(f"Could not hash {path}: {str(e)}")
+            finally:
+                with self.lock:
+                    self.pending.discard(path)
+
+    def prune(self, library_paths) -> int:
+        """Drops hashes of inodes no longer present under the given libraries. Returns the number removed."""
+        live = set()
+        for library_path in library_paths:
+            for root, _, files in os.walk(library_path):
+                for name in files:
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except FileNotFoundError:
+                        continue
+                    live.add((stat.st_dev, stat.st_ino))
+
+        with self.lock:
+            rows = self.connection.execute("SELECT device, inode FROM hashes").fetchall()
+            stale = [row for row in rows if row not in live]
+            self.connection.executemany("DELETE FROM hashes WHERE device = ? AND inode = ?", stale)
+            self.connection.commit()
+        if stale:
+            logger.info(f"Pruned {len(stale)} stale media hashes")
+        return len(stale)
+
+if __name__ == '__main__':
+    import argparse
+    from app.config import MEDIA_HASH_STORE_PATH, MUSIC_LIBRARY_PATH, BOOK_LIBRARY_PATH
+
+    parser = argparse.ArgumentParser(description="Maintain the music and book hash store")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('prune')
+    args = parser.parse_args()
+
+    if args.command == 'prune':
+        print(f"Pruned {HashStore(MEDIA_HASH_STORE_PATH).prune([MUSIC_LIBRARY_PATH, BOOK_LIBRARY_PATH])} hashes")
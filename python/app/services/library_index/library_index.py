@@ -0,0 +1,284 @@
+import os
+import time
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app.services.library_index.hash_store import HashStore
+from app.services.library_index.archive_stream import TarStream
+
+# Directory mtimes are checked at most this often, so bursts of list calls cost no syscalls
+CHECK_INTERVAL_SECONDS = 1.0
+# Coarsest file mtime resolution we expect (FAT, exFAT), subtracted from server_time for `since`
+MTIME_RESOLUTION_SECONDS = 2.0
+# Suggested wait before asking again for a manifest whose hashes are still being computed
+HASH_RETRY_AFTER_SECONDS = 5
+
+class LibraryFolder:
+    """One album or book folder: its mtime when scanned and its files."""
+
+    def __init__(self, path: Path, mtime_ns: int, files: List[dict]):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.files = files
+        self.names = {file['name'] for file in files}
+        self.checked = time.monotonic()
+        # Newest of the folder's own mtime and its files' mtimes, in seconds
+        self.changed_at = max([mtime_ns] + [file['mtime_ns'] for file in files]) / 1e9
+
+    def restat(self) -> bool:
+        """
+        Refreshes the size and mtime of every file, since editing a file in place
+        (e.g. rewriting tags) does not change the folder mtime. Returns False if a
+        file is gone and the folder needs a rescan. The file list is swapped in
+        whole, so this is safe to call without the index lock.
+        """
+        files = []
+        for file in self.files:
+            try:
+                stat = os.stat(file['path'])
+            except FileNotFoundError:
+                return False
+            files.append({**file, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+        self.files = files
+        self.changed_at = max([self.mtime_ns] + [file['mtime_ns'] for file in files]) / 1e9
+        return True
+
+class LibraryIndex:
+    """
+    In-memory index of a library laid out as <library>/<folder>/<file>.
+
+    The whole library is read with os.scandir once at startup. Afterwards a
+    listing is served from memory; the library or folder mtime is re-checked at
+    most every CHECK_INTERVAL_SECONDS and only a folder whose entries changed
+    (added, removed or renamed files) is scanned again.
+    """
+
+    def __init__(self, library_path, hash_store: Optional[HashStore] = None, check_interval: float = CHECK_INTERVAL_SECONDS):
+        self.library_path = Path(library_path).resolve()
+        self.hash_store = hash_store
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.mtime_ns = None
+        self.root_checked = 0.0
+        self.folders: Dict[str, Optional[LibraryFolder]] = {}
+        self.initialize()
+
+    def initialize(self):
+        with self.lock:
+            self._refresh_root(force=True)
+            for name in self.folders:
+                self._refresh_folder(name, force=True)
+
+    @staticmethod
+    def _scan_files(path: Path) -> List[dict]:
+        files = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    files.append({
+                        "name": entry.name,
+                        "path": entry.path,
+                        "size": stat.st_size,
+                        "mtime_ns": stat.st_mtime_ns
+                    })
+        files.sort(key=lambda file: file['name'])
+        return files
+
+    def _refresh_root(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self.root_checked < self.check_interval:
+            return
+        self.root_checked = now
+
+        mtime_ns = os.stat(self.library_path).st_mtime_ns
+        if mtime_ns == self.mtime_ns:
+            return
+        self.mtime_ns = mtime_ns
+
+        with os.scandir(self.library_path) as entries:
+            names = sorted(entry.name for entry in entries if entry.is_dir() and not entry.name.startswith('.'))
+        # Keep folders that are still there, new ones are scanned on first use
+        self.folders = {name: self.folders.get(name) for name in names}
+
+    def _refresh_folder(self, name: str, force: bool = False, restat: bool = False) -> Optional[LibraryFolder]:
+        folder = self.folders.get(name)
+        now = time.monotonic()
+        if folder and not force and now - folder.checked < self.check_interval:
+            return folder
+
+        path = self.library_path / name
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self.folders.pop(name, None)
+            return None
+
+        if folder and folder.mtime_ns == mtime_ns and (not restat or folder.restat()):
+            folder.checked = now
+            return folder
+
+        folder = LibraryFolder(path, mtime_ns, self._scan_files(path))
+        self.folders[name] = folder
+        return folder
+
+    def list_folders(self) -> List[str]:
+        with self.lock:
+            self._refresh_root()
+            return list(self.folders)
+
+    def get_folder(self, name: str) -> LibraryFolder:
+        """Returns a folder of the library. Raises FileNotFoundError if there is none by that name."""
+        with self.lock:
+            self._refresh_root()
+            if name not in self.folders:
+                # Created since the last root check
+                self._refresh_root(force=True)
+            folder = self._refresh_folder(name) if name in self.folders else None
+        if folder is None:
+            raise FileNotFoundError(f"Folder not found: {name}")
+        return folder
+
+    def list_files(self, name: str) -> List[dict]:
+        return self.get_folder(name).files
+
+    def get_file_path(self, name: str, file_name: str) -> Path:
+        """Absolute path of a file in a folder. Raises FileNotFoundError if it isn't indexed there."""
+        folder = self.get_folder(name)
+        if file_name not in folder.names:
+            raise FileNotFoundError(f"File not found: {folder.path / file_name}")
+        return folder.path / file_name
+
+    def list_folders_with_files(self, names: Optional[List[str]] = None, since: Optional[float] = None,
+                                after: Optional[str] = None, limit: int = 100) -> Tuple[List[Tuple[str, LibraryFolder]], Optional[str], float]:
+        """
+        Many folders' listings in one call: the given names, or every folder in
+        name order starting after `after`. `since` keeps only folders changed at or
+        after that unix time. Returns (name, folder) pairs, the name to continue
+        after (None when done) and the server_time to pass as the next `since`.
+        Unknown names are skipped.
+
+        This is what clients sync against, so nothing is served from the check
+        interval: the root and every folder considered are stat'ed, and so are
+        their files, which catches in-place edits. The lock is taken per folder
+        and the files are stat'ed outside it, so a pass over the whole library
+        doesn't hold up other listings. server_time is taken before those stats
+        (minus the mtime resolution), so a change that lands while they run is
+        reported again next time rather than missed.
+        """
+        server_time = time.time() - MTIME_RESOLUTION_SECONDS
+        with self.lock:
+            self._refresh_root(force=True)
+            candidates = names if names is not None else [name for name in self.folders if after is None or name > after]
+
+        folders = []
+        for name in candidates:
+            with self.lock:
+                folder = self._refresh_folder(name, force=True) if name in self.folders else None
+            if folder is not None and not folder.restat():
+                # A file is gone without the folder mtime changing (e.g. coarse mtimes), rescan it
+                with self.lock:
+                    folder = self._refresh_folder(name, force=True, restat=True) if name in self.folders else None
+            if folder is None or (since is not None and folder.changed_at < since):
+                continue
+            folders.append((name, folder))
+            if names is None and len(folders) == limit:
+                return folders, name, server_time
+        return folders, None, server_time
+
+    def get_manifest(self, name: str) -> List[dict]:
+        """
+        Lists a folder's files with size, mtime and SHA-256, for delta sync.
+        Files are stat'ed here rather than trusted from the index, since editing a
+        file in place does not change its folder's mtime. Hashes come from the hash
+        store; a file it has no hash for yet is queued to be hashed in the background
+        and listed with sha256 None, so a large new folder doesn't hold up the request.
+        """
+        manifest = []
+        missing = []
+        for file in self.list_files(name):
+            try:
+                stat = os.stat(file['path'])
+            except FileNotFoundError:
+                continue
+            sha = self.hash_store.lookup_hash(file['path'], stat) if self.hash_store else None
+            if self.hash_store and sha is None:
+                missing.append(file['path'])
+            manifest.append({
+                "name": file['name'],
+                "path": file['path'],
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "sha256": sha
+            })
+        if missing:
+            self.hash_store.request_hashes(missing)
+        return manifest
+
+    def get_archive(self, name: str, file_names: Optional[List[str]] = None) -> TarStream:
+        """
+        A streamable tar of a folder (or of the chosen files, in the order given),
+        with members named <folder>/<file>. Raises FileNotFoundError for unknown names.
+        """
+        folder = self.get_folder(name)
+        if file_names is None:
+            file_names = [file['name'] for file in folder.files]
+
+        entries = []
+        for file_name in file_names:
+            if file_name not in folder.names:
+                raise FileNotFoundError(f"File not found: {folder.path / file_name}")
+            path = str(folder.path / file_name)
+            entries.append((f"{name}/{file_name}", path, os.stat(path)))
+        return TarStream(entries)
+
+def is_pending(manifest: List[dict]) -> bool:
+    """Whether some of a manifest's hashes are still being computed."""
+    return any(entry['sha256'] is None for entry in manifest)
+
+def validate_client_files(client_files: List[dict]) -> None:
+    """
+    Checks a client's file list: every entry needs a string name, size must be
+    an int and sha256 a string when given. Raises ValueError naming the bad entry.
+    """
+    for index, file in enumerate(client_files):
+        if not isinstance(file, dict):
+            raise ValueError(f"File {index} is not an object")
+        if not isinstance(file.get('name'), str) or not file['name']:
+            raise ValueError(f"File {index} has no name")
+        size = file.get('size')
+        if size is not None and (not isinstance(size, int) or isinstance(size, bool)):
+            raise ValueError(f"File {index} ({file['name']}) has a non-integer size")
+        if file.get('sha256') is not None and not isinstance(file['sha256'], str):
+            raise ValueError(f"File {index} ({file['name']}) has a non-string sha256")
+
+def diff_manifest(manifest: List[dict], client_files: List[dict]) -> dict:
+    """
+    Compares a server manifest with the files a client holds ({name, size, sha256}).
+    A client file is current if its sha256 matches, or, when either side has no
+    hash yet, its size. Returns the manifest entries to fetch, the names to delete
+    and how many server files were compared by size because their hash is pending.
+    Raises ValueError for malformed client entries.
+    """
+    validate_client_files(client_files)
+    client = {file['name']: file for file in client_files}
+    fetch = []
+    for entry in manifest:
+        local = client.get(entry['name'])
+        if local is None:
+            fetch.append(entry)
+        elif local.get('sha256') and entry['sha256']:
+            if local['sha256'].lower() != entry['sha256']:
+                fetch.append(entry)
+        elif local.get('size') != entry['size']:
+            fetch.append(entry)
+
+    server_names = {entry['name'] for entry in manifest}
+    return {
+        "fetch": fetch,
+        "delete": sorted(name for name in client if name not in server_names),
+        "unchanged": len(manifest) - len(fetch),
+        "fetch_bytes": sum(entry['size'] for entry in fetch),
+        "pending": sum(1 for entry in manifest if entry['sha256'] is None)
+    }
@@ -0,0 +1,278 @@
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+from logger import logger
+
+try:
+    import mutagen
+except ImportError:
+    mutagen = None
+
+AUDIO_EXTENSIONS = {'mp3', 'flac', 'ogg', 'opus', 'm4a', 'mp4', 'aac', 'wav', 'wma', 'aiff'}
+INDEX_INTERVAL_SECONDS = 5 * 60
+BATCH_SIZE = 500
+
+def read_tags(path: str) -> dict:
+    """
+    Reads artist, album, title, track number and duration from ID3, Vorbis or MP4 tags.
+    Without mutagen, or for untagged files, the fields stay None and the caller
+    falls back to folder and file names.
+    """
+    tags = {"artist": None, "album": None, "title": None, "track_number": None, "duration": None}
+    if mutagen is None:
+        return tags
+    try:
+        audio = mutagen.File(path, easy=True)
+    except Exception as e:
+        logger.error(f"Failed to read tags of {path}: {e}")
+        return tags
+    if audio is None:
+        return tags
+
+    if audio.info is not None and getattr(audio.info, 'length', None):
+        tags["duration"] = round(audio.info.length, 2)
+    if audio.tags is not None:
+        for key in ("artist", "album", "title"):
+            values = audio.tags.get(key)
+            if values:
+                tags[key] = str(values[0])
+        track = audio.tags.get("tracknumber")
+        if track:
+            # '3/12' -> 3
+            match = re.match(r'\d+', str(track[0]))
+            tags["track_number"] = int(match.group()) if match else None
+    return tags
+
+class MusicMetadataIndex:
+    """
+    Tag index of the music library with full-text search.
+
+    Once started, a background thread walks the library and then every
+    INDEX_INTERVAL_SECONDS; only files whose size or mtime changed are re-read,
+    removed files are dropped. Tags land in a tracks table mirrored into an
+    FTS5 index (diacritics folded, prefix matching), so a search is one indexed
+    query instead of the client filtering album listings. Tags are read with
+    mutagen when it is installed; otherwise tracks are indexed by album folder
+    and file name only.
+    """
+
+    def __init__(self, library_path, index_path, interval_seconds: int = INDEX_INTERVAL_SECONDS):
+        self.library_path = Path(library_path).resolve()
+        self.index_path = index_path
+        self.interval_seconds = interval_seconds
+        self.update_lock = threading.Lock()
+        self.read_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.thread_lock = threading.Lock()
+        self.indexing = False
+        self.initialize()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.index_path, check_same_thread=False, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def initialize(self):
+        self.connection = self._connect()
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS tracks (
+                id INTEGER PRIMARY KEY,
+                album_dir TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                artist TEXT,
+                album TEXT,
+                title TEXT,
+                track_number INTEGER,
+                duration REAL,
+                UNIQUE (album_dir, file_name)
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(
+                title, artist, album, album_dir, file_name,
+                content='tracks', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+            );
+            CREATE TRIGGER IF NOT EXISTS tracks_ai AFTER INSERT ON tracks BEGIN
+                INSERT INTO tracks_fts (rowid, title, artist, album, album_dir, file_name)
+                VALUES (new.id, new.title, new.artist, new.album, new.album_dir, new.file_name);
+            END;
+            CREATE TRIGGER IF NOT EXISTS tracks_ad AFTER DELETE ON tracks BEGIN
+                INSERT INTO tracks_fts (tracks_fts, rowid, title, artist, album, album_dir, file_name)
+                VALUES ('delete', old.id, old.title, old.artist, old.album, old.album_dir, old.file_name);
+            END;
+            CREATE TRIGGER IF NOT EXISTS tracks_au AFTER UPDATE ON tracks BEGIN
+                INSERT INTO tracks_fts (tracks_fts, rowid, title, artist, album, album_dir, file_name)
+                VALUES ('delete', old.id, old.title, old.artist, old.album, old.album_dir, old.file_name);
+                INSERT INTO tracks_fts (rowid, title, artist, album, album_dir, file_name)
+                VALUES (new.id, new.title, new.artist, new.album, new.album_dir, new.file_name);
+            END;
+        """)
+        self.connection.commit()
+        # Searches get their own connection so they don't wait for a running update (WAL)
+        self.read_connection = self._connect()
+
+    def start(self) -> None:
+        """Starts the background indexer thread, unless it is already running. Cheap to call per request."""
+        if self.thread and self.thread.is_alive():
+            return
+
+        def run():
+            while not self.stop_event.is_set():
+                try:
+                    self.update()
+                except Exception as e:
+                    logger.error(f"Music metadata indexing failed: {e}")
+                self.stop_event.wait(self.interval_seconds)
+
+        with self.thread_lock:
+            if self.thread and self.thread.is_alive():
+                return
+            # Searches right after startup report the index as incomplete
+            self.indexing = True
+            self.thread = threading.Thread(target=run, name='music-metadata-index', daemon=True)
+            self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    def _scan(self) -> dict:
+        """
+        {(album_dir, file_name): (size, mtime_ns, path)} for every audio file in the library.
+        Albums and files removed while the walk runs are left out, not fatal.
+        """
+        found = {}
+        with os.scandir(self.library_path) as albums:
+            for album in albums:
+                if not album.is_dir() or album.name.startswith('.'):
+                    continue
+                try:
+                    with os.scandir(album.path) as entries:
+                        for entry in entries:
+                            extension = entry.name.rsplit('.', 1)[-1].lower() if '.' in entry.name else ''
+                            if extension not in AUDIO_EXTENSIONS:
+                                continue
+                            try:
+                                if entry.is_file():
+                                    stat = entry.stat()
+                                    found[(album.name, entry.name)] = (stat.st_size, stat.st_mtime_ns, entry.path)
+                            except FileNotFoundError:
+                                continue
+                except FileNotFoundError:
+                    continue
+        return found
+
+    def _upsert(self, rows: List[tuple]) -> None:
+        self.connection.executemany(
+            """
+            INSERT INTO tracks (album_dir, file_name, size, mtime_ns, artist, album, title, track_number, duration)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (album_dir, file_name) DO UPDATE SET
+                size = excluded.size, mtime_ns = excluded.mtime_ns, artist = excluded.artist, album = excluded.album,
+                title = excluded.title, track_number = excluded.track_number, duration = excluded.duration
+            """,
+            rows
+        )
+        self.connection.commit()
+
+    def update(self) -> dict:
+        """Brings the index in line with the library, re-reading only changed files. Returns counts."""
+        with self.update_lock:
+            self.indexing = True
+            try:
+                on_disk = self._scan()
+                indexed = {
+                    (album_dir, file_name): (size, mtime_ns)
+                    for album_dir, file_name, size, mtime_ns in self.connection.execute(
+                        "SELECT album_dir, file_name, size, mtime_ns FROM tracks"
+                    )
+                }
+
+                removed = [key for key in indexed if key not in on_disk]
+                self.connection.executemany("DELETE FROM tracks WHERE album_dir = ? AND file_name = ?", removed)
+                self.connection.commit()
+
+                changed = [key for key, value in on_disk.items() if indexed.get(key) != value[:2]]
+                batch = []
+                for album_dir, file_name in changed:
+                    size, mtime_ns, path = on_disk[(album_dir, file_name)]
+                    tags = read_tags(path)
+                    batch.append((
+                        album_dir, file_name, size, mtime_ns,
+                        tags["artist"], tags["album"] or album_dir, tags["title"] or file_name.rsplit('.', 1)[0],
+                        tags["track_number"], tags["duration"]
+                    ))
+                    if len(batch) >= BATCH_SIZE:
+                        self._upsert(batch)
+                        batch = []
+                if batch:
+                    self._upsert(batch)
+            finally:
+                self.indexing = False
+
+        if changed or removed:
+            logger.info(f"Music metadata index updated: {len(changed)} read, {len(removed)} removed, {len(on_disk)} tracks")
+        return {"read": len(changed), "removed": len(removed), "tracks": len(on_disk)}
+
+    @staticmethod
+    def _to_match_query(query: str) -> Optional[str]:
+        # Every word must match as a prefix; quoting keeps FTS5 syntax characters literal
+        words = re.findall(r'\w+', query)
+        if not words:
+            return None
+        return ' '.join(f'"{word}"*' for word in words)
+
+    def search(self, query: str, limit: int = 50) -> List[dict]:
+        """Tracks matching every word of the query (as prefixes), best matches first."""
+        match_query = self._to_match_query(query)
+        if match_query is None:
+            return []
+
+        with self.read_lock:
+            rows = self.read_connection.execute(
+                """
+                SELECT tracks.album_dir, tracks.file_name, tracks.title, tracks.artist, tracks.album,
+                       tracks.track_number, tracks.duration
+                FROM tracks_fts JOIN tracks ON tracks.id = tracks_fts.rowid
+                WHERE tracks_fts MATCH ?
+                ORDER BY bm25(tracks_fts, 10.0, 5.0, 5.0, 1.0, 1.0)
+                LIMIT ?
+                """,
+                (match_query, limit)
+            ).fetchall()
+
+        return [
+            {
+                "album_dir": album_dir,
+                "file_name": file_name,
+                "title": title,
+                "artist": artist,
+                "album": album,
+                "track_number": track_number,
+                "duration": duration
+            }
+            for album_dir, file_name, title, artist, album, track_number, duration in rows
+        ]
+
+if __name__ == '__main__':
+    import argparse
+    from app.config import MUSIC_LIBRARY_PATH, MUSIC_INDEX_PATH
+
+    parser = argparse.ArgumentParser(description="Maintain the music metadata index")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('update')
+    search_parser = subparsers.add_parser('search')
+    search_parser.add_argument('query')
+    args = parser.parse_args()
+
+    index = MusicMetadataIndex(MUSIC_LIBRARY_PATH, MUSIC_INDEX_PATH)
+    if args.command == 'update':
+        print(index.update())
+    elif args.command == 'search':
+        for track in index.search(args.query):
+            print(f"{track['artist'] or '-'} - {track['title']} ({track['album_dir']}/{track['file_name']})")
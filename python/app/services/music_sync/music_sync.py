@@ -1,5 +1,10 @@
 from pathlib import Path
 
+from app.config import MEDIA_HASH_STORE_PATH, MUSIC_INDEX_PATH
+from app.services.library_index.library_index import LibraryIndex, diff_manifest
+from app.services.library_index.hash_store import HashStore
+from app.services.music_sync.music_metadata import MusicMetadataIndex
+
 class MusicSync:
     def __init__(self, music_library_path):
         self.music_library_path = Path(music_library_path).resolve()
@@ -7,6 +12,9 @@ class MusicSync:
 
     def initialize(self):
         self.ensure_folder_exists()
+        self.library_index = LibraryIndex(self.music_library_path, HashStore(MEDIA_HASH_STORE_PATH))
+        # Started by the music routes on their first request, not here at import
+        self.metadata_index = MusicMetadataIndex(self.music_library_path, MUSIC_INDEX_PATH)
 
     def ensure_folder_exists(self):
         self.music_library_path.mkdir(parents=True, exist_ok=True)
@@ -15,45 +23,74 @@ class MusicSync:
         """
         Retrieves a list of all album directories in the music library.
         """
-        try:
-            albums = [
-                album.name for album in self.music_library_path.iterdir()
-                if album.is_dir() and not album.name.startswith('.')
-            ]
-            return albums
-        except Exception as e:
-            raise e
+        return self.library_index.list_folders()
 
     def get_album_files(self, album_name):
         """
         Retrieves a list of all files within the specified album.
         Each file is represented as a dictionary with 'name' and 'path'.
         """
-        album_path = self.music_library_path / album_name
-        if not album_path.exists() or not album_path.is_dir():
+        try:
+            files = self.library_index.list_files(album_name)
+        except FileNotFoundError:
             raise FileNotFoundError(f"Album not found: {album_name}")
 
+        return [{"name": file["name"], "path": file["path"]} for file in files]
+
+    def get_album_manifest(self, album_name):
+        """
+        Retrieves the files of the specified album with size, mtime and sha256,
+        so the phone can tell which of its local copies are current. sha256 is
+        None for files still being hashed in the background.
+        """
         try:
-            files = [
-                {
-                    "name": file.name,
-                    "path": str(file.resolve())
-                }
-                for file in album_path.iterdir()
-                if file.is_file()
-            ]
-            return files
-        except Exception as e:
-            raise e
+            manifest = self.library_index.get_manifest(album_name)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Album not found: {album_name}")
+        return manifest
 
-    def get_file_path(self, album_name, file_name):
+    def diff_album(self, album_name, client_files):
         """
-        Constructs and returns the absolute path to the specified file within an album.
+        Compares the phone's copy of an album ([{name, size, sha256}]) with the server,
+        returning the files to fetch and the names to delete.
         """
-        album_path = self.music_library_path / album_name
-        file_path = album_path / file_name
+        return diff_manifest(self.get_album_manifest(album_name), client_files)
 
-        if not file_path.exists() or not file_path.is_file():
-            raise FileNotFoundError(f"File not found: {file_path}")
+    def get_album_archive(self, album_name, file_names=None):
+        """
+        Returns a streamable tar of the album, or of the chosen files only.
+        """
+        return self.library_index.get_archive(album_name, file_names)
 
-        return file_path.resolve()
+    def get_albums_files(self, album_names=None, since=None, cursor=None, limit=100):
+        """
+        Retrieves the file lists of many albums in one call: the given albums, or
+        all of them a page at a time. With `since` (unix time), only albums
+        changed since then are included. Returns the albums, the next cursor and
+        the server time to send as the next `since`.
+        """
+        folders, next_cursor, server_time = self.library_index.list_folders_with_files(album_names, since, cursor, limit)
+        albums = [
+            {
+                "name": name,
+                "changed_at": folder.changed_at,
+                "files": [
+                    {"name": file["name"], "path": file["path"], "size": file["size"], "mtime": file["mtime_ns"] / 1e9}
+                    for file in folder.files
+                ]
+            }
+            for name, folder in folders
+        ]
+        return albums, next_cursor, server_time
+
+    def search(self, query, limit=50):
+        """
+        Searches track titles, artists, albums and file names in the metadata index.
+        """
+        return self.metadata_index.search(query, limit)
+
+    def get_file_path(self, album_name, file_name):
+        """
+        Returns the absolute path to the specified file within an album.
+        """
+        return self.library_index.get_file_path(album_name, file_name)
@@ -1,20 +1,57 @@
 import os
+import threading
 from logger import logger
+from app.services.backup_store.backup_store import BackupStore
 
-def cleanup_old_backups(backup_dir: str, keep_last: int = 10):
+# Cleanup reads every manifest and lists the whole object store, so it runs once every this many backups
+CLEANUP_EVERY = 20
+
+# Starts full, so the first backup after a restart triggers a cleanup
+_backups_since_cleanup = CLEANUP_EVERY
+_counter_lock = threading.Lock()
+_cleanup_lock = threading.Lock()
+
+def cleanup_old_backups(backup_store: BackupStore, backup_dir: str, keep_last: int = 300):
     """
-    Removes old backups keeping only the most recent ones
+    Moves legacy full-copy backups into the backup store and keeps only the most recent ones
     """
     try:
-        # Get list of backup files
+        # Get list of legacy backup files
         backups = [f for f in os.listdir(backup_dir) if f.startswith('LocalDB_') and f.endswith('.db')]
-        backups.sort(reverse=True)  # Sort newest to oldest
         
-        # Remove old backups
-        for backup in backups[keep_last:]:
+        # Import them as restore points, then drop the full copies
+        for backup in sorted(backups):
             backup_path = os.path.join(backup_dir, backup)
+            backup_store.add_backup(backup_path, name=backup[:-len('.db')])
             os.remove(backup_path)
-            logger.info("Removed old backup: %s", backup_path)
+            logger.info("Moved legacy backup into store: %s", backup_path)
+        
+        # Remove old restore points and their unreferenced chunks
+        removed = backup_store.prune(keep_last)
+        if removed:
+            logger.info("Removed %s unreferenced backup chunks", removed)
             
     except Exception as e:
-        logger.error("Error cleaning up old backups: %s", str(e))
\ No newline at end of file
+        logger.error("Error cleaning up old backups: %s", str(e))
+
+def schedule_cleanup(backup_store: BackupStore, backup_dir: str, keep_last: int = 300, every: int = CLEANUP_EVERY):
+    """
+    Counts backups and runs cleanup_old_backups on a background thread every
+    `every` of them, so uploads never wait for it. At most one cleanup runs at a time.
+    """
+    global _backups_since_cleanup
+    with _counter_lock:
+        _backups_since_cleanup += 1
+        if _backups_since_cleanup < every:
+            return
+        _backups_since_cleanup = 0
+
+    def run():
+        if not _cleanup_lock.acquire(blocking=False):
+            return
+        try:
+            cleanup_old_backups(backup_store, backup_dir, keep_last)
+        finally:
+            _cleanup_lock.release()
+
+    threading.Thread(target=run, name='backup-cleanup', daemon=True).start()
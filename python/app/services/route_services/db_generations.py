@@ -0,0 +1,191 @@
+import os
+import re
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+from logger import logger
+from app.config import DB_PATH, DB_DIRECTORY
+
+CHUNK_SIZE = 1024 * 1024
+FICLONE = 0x40049409  # Linux ioctl for reflink copies (btrfs, xfs)
+GENERATIONS_DIRECTORY = os.path.join(DB_DIRECTORY, 'generations')
+GENERATION_PATTERN = re.compile(r'^(\d{8})-([0-9a-f]{64})\.db$')
+
+def hash_file(path: str) -> str:
+    """Calculate SHA-256 of a file without loading it in memory."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def _signature(path: str):
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+def clone_file(src: str, dest: str) -> None:
+    """Copies src to dest as a reflink when the filesystem supports it, otherwise as a regular copy."""
+    try:
+        import fcntl
+        with open(src, 'rb') as s, open(dest, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        shutil.copystat(src, dest)
+        return
+    except (ImportError, OSError):
+        pass
+    shutil.copy2(src, dest)
+
+class Generation:
+    """An immutable published database file. Readers pin it so it is not reclaimed under them."""
+
+    def __init__(self, number: int, sha: str, path: str):
+        self.number = number
+        self.sha = sha
+        self.path = path
+        self.refs = 0
+
+class GenerationRegistry:
+    """
+    Versioned snapshots of LocalDB.
+
+    Every upload lands as a new immutable file under generations/ and becomes
+    current through a pointer swap under a lock; DB_PATH is then replaced with a
+    copy of it for tools that open the database by path. DB_PATH never shares
+    an inode with a generation, so writes through it cannot change a file that
+    readers have open as immutable; such writes are imported as a new
+    generation instead. Readers pin the generation they started with and keep
+    reading it even if a newer one is published, and old generations are
+    deleted once no reader holds them.
+    """
+
+    def __init__(self, generations_path: str = GENERATIONS_DIRECTORY, db_path: str = DB_PATH):
+        self.generations_path = generations_path
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.current: Optional[Generation] = None
+        # Signature of DB_PATH when it last matched the current generation
+        self.db_signature = None
+        self.retired = []
+        self.initialize()
+
+    def initialize(self):
+        os.makedirs(self.generations_path, exist_ok=True)
+
+        found = []
+        for filename in os.listdir(self.generations_path):
+            match = GENERATION_PATTERN.match(filename)
+            if match:
+                found.append((int(match.group(1)), match.group(2), os.path.join(self.generations_path, filename)))
+            elif filename.endswith('.tmp'):
+                os.remove(os.path.join(self.generations_path, filename))
+        found.sort()
+
+        # No reader survives a restart, so only the newest generation is kept
+        for _, _, path in found[:-1]:
+            os.remove(path)
+        if found:
+            self.current = Generation(*found[-1])
+            if os.path.exists(self.db_path) and os.path.samefile(self.db_path, self.current.path):
+                # Left hardlinked by an older version, split it off before anyone writes to it
+                self._copy_to_db_path(self.current.path)
+            elif os.path.exists(self.db_path) and hash_file(self.db_path) == self.current.sha:
+                self.db_signature = _signature(self.db_path)
+
+        self._import_external_changes()
+
+    def _import_external_changes(self) -> None:
+        """
+        Publishes DB_PATH as a new generation if it was replaced or edited outside
+        the registry (a restored backup, a notebook writing to it).
+        """
+        if not os.path.exists(self.db_path):
+            return
+        signature = _signature(self.db_path)
+        if self.current and signature == self.db_signature:
+            return
+
+        # A copy, not a link: DB_PATH stays writable without touching the generation
+        tmp_path = os.path.join(self.generations_path, 'import.tmp')
+        clone_file(self.db_path, tmp_path)
+        logger.info("Importing externally changed database: %s", self.db_path)
+        self._publish_locked(tmp_path, hash_file(tmp_path), db_signature=signature)
+
+    def _publish_locked(self, tmp_path: str, sha: str, db_signature=None) -> Generation:
+        """
+        db_signature is passed when DB_PATH already holds these bytes (an import),
+        otherwise DB_PATH is replaced with a copy of the new generation.
+        """
+        number = self.current.number + 1 if self.current else 1
+        path = os.path.join(self.generations_path, f"{number:08d}-{sha}.db")
+        os.replace(tmp_path, path)
+
+        # Keep a copy of the current generation at DB_PATH for path-based tools
+        if db_signature is None:
+            self._copy_to_db_path(path)
+        else:
+            self.db_signature = db_signature
+
+        previous = self.current
+        self.current = Generation(number, sha, path)
+        if previous:
+            self.retired.append(previous)
+        self._reclaim()
+        return self.current
+
+    def _copy_to_db_path(self, path: str) -> None:
+        copy_path = self.db_path + '.tmp'
+        clone_file(path, copy_path)
+        os.replace(copy_path, self.db_path)
+        self.db_signature = _signature(self.db_path)
+
+    def publish(self, tmp_path: str, sha: str) -> Generation:
+        """Makes tmp_path the current generation with an atomic pointer swap."""
+        with self.lock:
+            generation = self._publish_locked(tmp_path, sha)
+        logger.info("Database generation %s published (%s)", generation.number, sha[:12])
+        return generation
+
+    def acquire(self, generation: Optional[Generation] = None) -> Optional[Generation]:
+        """
+        Pins and returns the current generation (or the given one, which must not
+        be reclaimed yet). Returns None if there is no database yet.
+        """
+        with self.lock:
+            if generation is None:
+                self._import_external_changes()
+                generation = self.current
+            if generation is None:
+                return None
+            generation.refs += 1
+            return generation
+
+    def release(self, generation: Generation) -> None:
+        with self.lock:
+            generation.refs -= 1
+            self._reclaim()
+
+    def _reclaim(self) -> None:
+        for generation in list(self.retired):
+            if generation.refs <= 0:
+                self.retired.remove(generation)
+                try:
+                    os.remove(generation.path)
+                    logger.info("Reclaimed database generation %s", generation.number)
+                except FileNotFoundError:
+                    pass
+
+    @contextmanager
+    def pinned(self):
+        """Context manager yielding the pinned current generation (or None)."""
+        generation = self.acquire()
+        try:
+            yield generation
+        finally:
+            if generation:
+                self.release(generation)
+
+# Shared by every route that reads or publishes LocalDB
+generations = GenerationRegistry()
@@ -0,0 +1,187 @@
+import os
+import gzip
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from typing import Optional, Tuple
+
+from logger import logger
+from app.config import DB_DIRECTORY
+from app.services.route_services.db_generations import generations, hash_file, clone_file, Generation
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 1024 * 1024
+COMPRESSED_DIRECTORY = os.path.join(DB_DIRECTORY, 'compressed')
+COMPRESSED_EXTENSIONS = {'zstd': 'zst', 'gzip': 'gz'}
+# A compression temp file older than this was left by a crash, younger ones may still be written to
+STALE_TEMP_SECONDS = 60 * 60
+
+# Every SQLite database file starts with this, anything else is not a database
+SQLITE_HEADER = b'SQLite format 3\x00'
+# Content types /upload_sqlite takes as a raw database body
+RAW_DB_MIMETYPES = ('application/octet-stream', 'application/x-sqlite3')
+
+# Serializes writers that read-modify-write the database (delta syncs)
+write_lock = threading.Lock()
+
+class HashMismatchError(ValueError):
+    """Raised when the uploaded bytes do not match the hash announced by the client."""
+
+class InvalidDatabaseError(ValueError):
+    """Raised when an upload is empty or is not a SQLite database."""
+
+def check_database_file(path: str) -> None:
+    """Raises InvalidDatabaseError unless the file starts with the SQLite header."""
+    with open(path, 'rb') as f:
+        header = f.read(len(SQLITE_HEADER))
+    if not header:
+        raise InvalidDatabaseError("Uploaded database is empty")
+    if header != SQLITE_HEADER:
+        raise InvalidDatabaseError("Upload is not a SQLite database")
+
+def get_db_hash() -> Optional[str]:
+    """Returns the SHA-256 of the current database, as recorded when it was published."""
+    with generations.pinned() as generation:
+        return generation.sha if generation else None
+
+def new_temp_path() -> str:
+    """Creates an empty temp file beside the database so it can be renamed into place atomically."""
+    fd, tmp_path = tempfile.mkstemp(dir=DB_DIRECTORY, prefix='.LocalDB.', suffix='.tmp')
+    os.close(fd)
+    return tmp_path
+
+def write_stream(stream, dest_path: str) -> str:
+    """Copies a stream to dest_path in fixed-size chunks, hashing as it goes. Returns the SHA-256."""
+    sha = hashlib.sha256()
+    with open(dest_path, 'wb') as f:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            sha.update(chunk)
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    return sha.hexdigest()
+
+def publish(tmp_path: str, sha: str) -> Generation:
+    """
+    Publishes tmp_path as a new database generation. Readers pinned to the old
+    one keep a consistent view; new readers only ever see a complete database.
+    """
+    generation = generations.publish(tmp_path, sha)
+
+    # Compress once per upload in the background, downloads serve the result
+    generations.acquire(generation)
+    threading.Thread(target=_precompress_generation, args=(generation,), daemon=True).start()
+    return generation
+
+def _precompress_generation(generation: Generation) -> None:
+    try:
+        precompress(generation.path, generation.sha)
+    finally:
+        generations.release(generation)
+
+def get_compressed_path(sha: str, encoding: str) -> str:
+    return os.path.join(COMPRESSED_DIRECTORY, f"{sha}.db.{COMPRESSED_EXTENSIONS[encoding]}")
+
+def get_available_encodings() -> list:
+    """Content encodings we can precompress to, in order of preference."""
+    return [encoding for encoding in COMPRESSED_EXTENSIONS if encoding != 'zstd' or zstandard]
+
+def _remove_stale_compressed(current: set) -> None:
+    """
+    Removes compressed copies of older databases, keeping the newest ones besides
+    `current` for in-flight downloads. Temp files are only removed once they are
+    older than STALE_TEMP_SECONDS, so other threads' copies in progress survive.
+    """
+    copies, temps = [], []
+    with os.scandir(COMPRESSED_DIRECTORY) as entries:
+        for entry in entries:
+            try:
+                mtime = entry.stat().st_mtime
+            except FileNotFoundError:
+                # Renamed or removed by a concurrent precompress
+                continue
+            (temps if entry.name.endswith('.tmp') else copies).append((mtime, entry.path))
+
+    copies.sort(reverse=True)
+    stale = [path for _, path in copies if path not in current][len(current):]
+    cutoff = time.time() - STALE_TEMP_SECONDS
+    stale += [path for mtime, path in temps if mtime < cutoff]
+    for path in stale:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def precompress(src_path: str, sha: str) -> None:
+    """
+    Writes gzip (and zstd, when available) copies of a published database, named by its hash.
+    Copies of older databases are removed, keeping the previous one for in-flight downloads.
+    """
+    try:
+        os.makedirs(COMPRESSED_DIRECTORY, exist_ok=True)
+        for encoding in get_available_encodings():
+            dest_path = get_compressed_path(sha, encoding)
+            if os.path.exists(dest_path):
+                continue
+
+            # Unique per call, several uploads can be compressing at once
+            fd, tmp_path = tempfile.mkstemp(dir=COMPRESSED_DIRECTORY, prefix=f".{sha}.", suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as raw, open(src_path, 'rb') as src:
+                    if encoding == 'zstd':
+                        zstandard.ZstdCompressor(level=10).copy_stream(src, raw)
+                    else:
+                        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6, mtime=0) as dest:
+                            shutil.copyfileobj(src, dest, CHUNK_SIZE)
+                os.replace(tmp_path, dest_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            logger.info("Precompressed database (%s): %s bytes", encoding, os.path.getsize(dest_path))
+
+        _remove_stale_compressed({get_compressed_path(sha, encoding) for encoding in get_available_encodings()})
+    except Exception as e:
+        logger.error("Error precompressing database: %s", str(e))
+
+def receive_stream(stream, expected_hash: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Writes an uploaded database to a temp file beside DB_PATH exactly once,
+    hashing it and checking that it is a SQLite database. Returns (tmp_path, sha)
+    for the caller to publish; nothing is locked while the upload is read.
+    """
+    tmp_path = new_temp_path()
+    try:
+        sha = write_stream(stream, tmp_path)
+        if expected_hash and sha != expected_hash.lower():
+            raise HashMismatchError(f"Upload hash {sha} does not match expected {expected_hash}")
+        check_database_file(tmp_path)
+        return tmp_path, sha
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def ingest_file(path: str, sha: Optional[str] = None) -> Generation:
+    """
+    Publishes a file that is already fully written beside DB_PATH, such as an
+    assembled chunked upload, by renaming it into place. Returns the new generation.
+    Raises InvalidDatabaseError, leaving the file in place, if it is not a SQLite database.
+    """
+    check_database_file(path)
+    return publish(path, sha or hash_file(path))
+
+def copy_for_update() -> str:
+    """
+    Returns a private copy of the database for a read-modify-write update.
+    Published files are never modified in place, so readers holding one keep a consistent view.
+    """
+    tmp_path = new_temp_path()
+    with generations.pinned() as generation:
+        clone_file(generation.path, tmp_path)
+    return tmp_path
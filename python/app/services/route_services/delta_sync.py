@@ -0,0 +1,141 @@
+import sqlite3
+from typing import Dict, List, Tuple
+
+from logger import logger
+
+EXCLUDED_TABLES = ('android_metadata', 'sqlite_sequence')
+
+class SchemaMismatchError(ValueError):
+    """Raised when a delta does not fit the server schema; the phone should fall back to a full upload."""
+
+class InvalidDeltaError(ValueError):
+    """Raised when a delta is malformed (a row that is not an object, a missing uuid, a nested value)."""
+
+# Types a JSON value can have and still bind as a SQLite parameter
+COLUMN_VALUE_TYPES = (str, int, float, bool, type(None))
+
+def _get_syncable_tables(conn: sqlite3.Connection) -> Dict[str, List[str]]:
+    """
+    Returns {table_name: [columns]} for every table that can take part in a delta sync,
+    i.e. tables with both a uuid and an updatedAt column.
+    """
+    tables = {}
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+    for (table_name,) in rows:
+        if table_name in EXCLUDED_TABLES:
+            continue
+        columns = [col[1] for col in conn.execute(f'PRAGMA table_info("{table_name}")').fetchall()]
+        if 'uuid' in columns and 'updatedAt' in columns:
+            tables[table_name] = columns
+    return tables
+
+def get_watermarks(db_path: str) -> Dict[str, str]:
+    """
+    Returns the newest updatedAt the server holds for each syncable table.
+    The phone sends only rows newer than these values.
+    """
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro&immutable=1", uri=True)
+    try:
+        watermarks = {}
+        for table_name in _get_syncable_tables(conn):
+            (latest,) = conn.execute(f'SELECT MAX(updatedAt) FROM "{table_name}"').fetchone()
+            watermarks[table_name] = latest
+        return watermarks
+    finally:
+        conn.close()
+
+def validate_delta(tables, deleted=None) -> None:
+    """
+    Checks the shape of a delta before anything is written: every table maps to
+    a list of row objects, each with a string uuid, an updatedAt and only scalar
+    values, and deletions map tables to lists of uuids. Raises InvalidDeltaError
+    naming the first bad row.
+    """
+    if not isinstance(tables, dict):
+        raise InvalidDeltaError("tables must be an object of table name to rows")
+    for table_name, rows in tables.items():
+        if not isinstance(rows, list):
+            raise InvalidDeltaError(f"Rows of {table_name} must be a list")
+        for index, row in enumerate(rows):
+            if not isinstance(row, dict):
+                raise InvalidDeltaError(f"{table_name} row {index} is not an object")
+            if not isinstance(row.get('uuid'), str) or not row['uuid']:
+                raise InvalidDeltaError(f"{table_name} row {index} has no uuid")
+            if not isinstance(row.get('updatedAt'), (str, int, float)) or isinstance(row['updatedAt'], bool):
+                raise InvalidDeltaError(f"{table_name} row {index} ({row['uuid']}) has no valid updatedAt")
+            for column, value in row.items():
+                if not isinstance(value, COLUMN_VALUE_TYPES):
+                    raise InvalidDeltaError(f"{table_name} row {index} ({row['uuid']}) has a non-scalar value for {column}")
+
+    if deleted is None:
+        return
+    if not isinstance(deleted, dict):
+        raise InvalidDeltaError("deleted must be an object of table name to uuids")
+    for table_name, uuids in deleted.items():
+        if not isinstance(uuids, list) or not all(isinstance(uuid, str) and uuid for uuid in uuids):
+            raise InvalidDeltaError(f"Deleted uuids of {table_name} must be a list of strings")
+
+def apply_delta(db_path: str, tables: Dict[str, List[dict]], deleted: Dict[str, List[str]] = None) -> Tuple[Dict[str, int], Dict[str, str]]:
+    """
+    Applies changed rows (and optional deletions by uuid) in a single transaction.
+    Rows are upserted on uuid; a row only overwrites the server copy if its updatedAt is newer.
+    The delta is expected to have passed validate_delta. A row that breaks another
+    constraint raises SchemaMismatchError, so the phone falls back to a full upload.
+    Returns the number of applied rows per table and the new watermarks.
+    """
+    deleted = deleted or {}
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        schema = _get_syncable_tables(conn)
+
+        for table_name in set(tables) | set(deleted):
+            if table_name not in schema:
+                raise SchemaMismatchError(f"Unknown table: {table_name}")
+
+        applied = {}
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for table_name, rows in tables.items():
+                known_columns = set(schema[table_name])
+                count = 0
+                for index, row in enumerate(rows):
+                    unknown = set(row) - known_columns
+                    if unknown:
+                        raise SchemaMismatchError(f"Unknown columns for {table_name}: {sorted(unknown)}")
+
+                    columns = list(row.keys())
+                    updates = [col for col in columns if col not in ('uuid', 'createdAt')]
+                    query = 'INSERT INTO "{table}" ({cols}) VALUES ({placeholders}) ON CONFLICT(uuid) DO '.format(
+                        table=table_name,
+                        cols=','.join(f'"{col}"' for col in columns),
+                        placeholders=','.join('?' for _ in columns)
+                    )
+                    if updates:
+                        query += 'UPDATE SET {sets} WHERE "{table}".updatedAt IS NULL OR excluded.updatedAt > "{table}".updatedAt'.format(
+                            table=table_name,
+                            sets=','.join(f'"{col}" = excluded."{col}"' for col in updates)
+                        )
+                    else:
+                        query += 'NOTHING'
+
+                    try:
+                        cursor = conn.execute(query, tuple(row.values()))
+                    except sqlite3.IntegrityError as e:
+                        # Another UNIQUE or NOT NULL constraint the two copies disagree on, a delta can't reconcile that
+                        raise SchemaMismatchError(f"{table_name} row {index} ({row['uuid']}) conflicts with the server copy: {e}") from e
+                    count += cursor.rowcount
+                applied[table_name] = count
+
+            for table_name, uuids in deleted.items():
+                if uuids:
+                    conn.executemany(f'DELETE FROM "{table_name}" WHERE uuid = ?', [(uuid,) for uuid in uuids])
+
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        logger.info("Delta applied: %s", applied)
+        return applied, get_watermarks(db_path)
+    finally:
+        conn.close()
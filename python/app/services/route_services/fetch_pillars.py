@@ -1,17 +1,23 @@
 import sqlite3
-from pathlib import Path
+
+from app.services.route_services.db_generations import generations
 
 def fetch_pillars():
     """
     Fetches all pillars from the local SQLite database.
     Returns a list of dictionaries containing pillar data.
     """
-    # Get the absolute path to the database file
-    db_path = Path(__file__).parent.parent.parent.parent / 'database_files' / 'LocalDB.db'
-    
+    # Pin the current database generation, a sync can't replace it while we read
+    with generations.pinned() as generation:
+        if generation is None:
+            print("Database error: no database uploaded yet")
+            return []
+        return _read_pillars(generation.path)
+
+def _read_pillars(db_path: str):
     try:
-        # Connect to the database
-        conn = sqlite3.connect(str(db_path))
+        # Connect to the database, generations never change once published
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro&immutable=1", uri=True)
         # Create a cursor that returns rows as dictionaries
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
@@ -0,0 +1,60 @@
+import os
+from urllib.parse import quote
+from flask import send_file, request, Response
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+
+def get_etag(stat: os.stat_result) -> str:
+    """Strong validator from inode, size and mtime, it changes whenever the file is replaced or edited."""
+    return f"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+def send_library_file(file_path, mimetype: str, download_name: str):
+    """
+    Serves a file with Range / 206 Partial Content, If-Range, ETag and
+    Last-Modified support, so clients can seek and resume interrupted downloads.
+    The body goes through the WSGI file wrapper (sendfile where the server supports it).
+    """
+    stat = os.stat(file_path)
+    try:
+        return send_file(
+            file_path,
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=download_name,
+            etag=get_etag(stat),
+            last_modified=stat.st_mtime,
+            conditional=True
+        )
+    except RequestedRangeNotSatisfiable as e:
+        # 416 with Content-Range: bytes */size, rather than a generic error
+        return e.get_response()
+
+def send_archive(archive, download_name: str):
+    """
+    Streams a TarStream with ETag, Range / 206 and If-Range support, so an
+    interrupted album or book download resumes from the last received byte.
+    """
+    response = Response(mimetype='application/x-tar', direct_passthrough=True)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(download_name)}"
+    response.set_etag(archive.etag)
+
+    if request.if_none_match and archive.etag in request.if_none_match:
+        response.status_code = 304
+        return response
+
+    start, stop = 0, archive.size
+    # A Range only applies if the archive is still the one the client started (If-Range)
+    if_range = request.if_range
+    range_valid = (if_range.etag is None and if_range.date is None) or if_range.etag == archive.etag
+    if request.range and range_valid:
+        byte_range = request.range.range_for_length(archive.size)
+        if byte_range is None:
+            error = RequestedRangeNotSatisfiable(length=archive.size)
+            return error.get_response()
+        start, stop = byte_range
+        response.status_code = 206
+        response.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{archive.size}"
+
+    response.response = archive.iter_bytes(start, stop)
+    response.content_length = stop - start
+    return response
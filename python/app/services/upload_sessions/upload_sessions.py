@@ -0,0 +1,171 @@
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+from pathlib import Path
+from typing import List, Optional
+
+from logger import logger
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+MAX_UPLOAD_SIZE = 4 * 1024 * 1024 * 1024
+SESSION_TTL_SECONDS = 24 * 60 * 60
+READ_SIZE = 1024 * 1024
+SESSION_KINDS = ('db', 'image')
+
+class UploadSessionError(ValueError):
+    """Raised for invalid session parameters or chunks; maps to a 400 response."""
+
+class UploadSessions:
+    """
+    Resumable chunked uploads.
+
+    Each session is a folder holding meta.json, a preallocated data file that
+    chunks are written into at their offset, and one marker file per received
+    chunk. Chunks are streamed to disk in fixed-size reads, so memory stays
+    bounded whatever the file size, and a dropped connection only costs the
+    chunk in flight.
+    """
+
+    def __init__(self, sessions_path, ttl_seconds: int = SESSION_TTL_SECONDS):
+        self.sessions_path = Path(sessions_path).resolve()
+        self.ttl_seconds = ttl_seconds
+        self.initialize()
+
+    def initialize(self):
+        self.sessions_path.mkdir(parents=True, exist_ok=True)
+
+    def _session_path(self, upload_id: str) -> Path:
+        if not re.fullmatch(r'[0-9a-f]{32}', upload_id):
+            raise FileNotFoundError(f"Upload session not found: {upload_id}")
+        session_path = self.sessions_path / upload_id
+        if not session_path.is_dir():
+            raise FileNotFoundError(f"Upload session not found: {upload_id}")
+        return session_path
+
+    def get_data_path(self, upload_id: str) -> str:
+        return str(self._session_path(upload_id) / 'data')
+
+    def get_meta(self, upload_id: str) -> dict:
+        with open(self._session_path(upload_id) / 'meta.json') as f:
+            return json.load(f)
+
+    def create_session(self, kind: str, size: int, chunk_size: int = DEFAULT_CHUNK_SIZE, sha256: Optional[str] = None, **extra) -> dict:
+        """Creates a session and preallocates its data file. Returns the session metadata."""
+        if kind not in SESSION_KINDS:
+            raise UploadSessionError(f"Unknown upload kind: {kind}")
+        if not 0 < size <= MAX_UPLOAD_SIZE:
+            raise UploadSessionError(f"Invalid upload size: {size}")
+        if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            raise UploadSessionError(f"Invalid chunk size: {chunk_size}")
+
+        self.collect_garbage()
+
+        upload_id = uuid.uuid4().hex
+        session_path = self.sessions_path / upload_id
+        (session_path / 'chunks').mkdir(parents=True)
+        with open(session_path / 'data', 'wb') as f:
+            f.truncate(size)
+
+        meta = {
+            "upload_id": upload_id,
+            "kind": kind,
+            "size": size,
+            "chunk_size": chunk_size,
+            "total_chunks": -(-size // chunk_size),
+            "sha256": sha256.lower() if sha256 else None,
+            "created": time.time(),
+            **extra
+        }
+        with open(session_path / 'meta.json', 'w') as f:
+            json.dump(meta, f)
+
+        logger.info("Upload session %s created: %s, %s bytes in %s chunks", upload_id, kind, size, meta['total_chunks'])
+        return meta
+
+    def write_chunk(self, upload_id: str, index: int, stream, expected_hash: Optional[str] = None) -> None:
+        """
+        Streams one chunk into the data file at its offset.
+        The chunk only counts as received once its length and checksum are verified;
+        a chunk sent again loses its marker first, so a bad resend shows as missing.
+        """
+        session_path = self._session_path(upload_id)
+        meta = self.get_meta(upload_id)
+        if not 0 <= index < meta['total_chunks']:
+            raise UploadSessionError(f"Chunk index out of range: {index}")
+
+        offset = index * meta['chunk_size']
+        expected_length = min(meta['chunk_size'], meta['size'] - offset)
+
+        # Its bytes are about to be overwritten, the earlier upload no longer counts
+        marker = session_path / 'chunks' / str(index)
+        marker.unlink(missing_ok=True)
+
+        sha = hashlib.sha256()
+        written = 0
+        fd = os.open(session_path / 'data', os.O_WRONLY)
+        try:
+            while written <= expected_length:
+                data = stream.read(READ_SIZE)
+                if not data:
+                    break
+                if written + len(data) > expected_length:
+                    raise UploadSessionError(f"Chunk {index} is larger than {expected_length} bytes")
+                os.pwrite(fd, data, offset + written)
+                sha.update(data)
+                written += len(data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+        if written != expected_length:
+            raise UploadSessionError(f"Chunk {index} has {written} bytes, expected {expected_length}")
+        if expected_hash and sha.hexdigest() != expected_hash.lower():
+            raise UploadSessionError(f"Checksum mismatch for chunk {index}")
+
+        marker.touch()
+        os.utime(session_path / 'meta.json')
+
+    def get_missing_chunks(self, upload_id: str) -> List[int]:
+        meta = self.get_meta(upload_id)
+        received = {int(name) for name in os.listdir(self._session_path(upload_id) / 'chunks')}
+        return [index for index in range(meta['total_chunks']) if index not in received]
+
+    def verify_complete(self, upload_id: str) -> dict:
+        """Checks that every chunk arrived and the whole file matches its announced hash."""
+        meta = self.get_meta(upload_id)
+        missing = self.get_missing_chunks(upload_id)
+        if missing:
+            raise UploadSessionError(f"Upload incomplete, {len(missing)} chunks missing")
+
+        if meta['sha256']:
+            sha = hashlib.sha256()
+            with open(self.get_data_path(upload_id), 'rb') as f:
+                for data in iter(lambda: f.read(READ_SIZE), b''):
+                    sha.update(data)
+            if sha.hexdigest() != meta['sha256']:
+                raise UploadSessionError("Checksum mismatch for the assembled file")
+        return meta
+
+    def delete_session(self, upload_id: str) -> None:
+        shutil.rmtree(self._session_path(upload_id), ignore_errors=True)
+
+    def collect_garbage(self) -> int:
+        """Removes sessions that received nothing for longer than the TTL. Returns how many were removed."""
+        removed = 0
+        cutoff = time.time() - self.ttl_seconds
+        for session_path in self.sessions_path.iterdir():
+            meta_path = session_path / 'meta.json'
+            try:
+                last_activity = meta_path.stat().st_mtime if meta_path.exists() else session_path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if last_activity < cutoff:
+                shutil.rmtree(session_path, ignore_errors=True)
+                logger.info("Removed abandoned upload session: %s", session_path.name)
+                removed += 1
+        return removed
@@ -0,0 +1,80 @@
+"""
+Benchmark for the deduplicated backup store.
+
+Simulates a series of phone syncs (a few changed rows each) against a
+synthetic database, stores every version, and reports dedupe ratio and
+restore time. Run from the python/ folder:
+
+    python -m benchmarks.backup_store_benchmark --rows 200000 --syncs 50
+"""
+import os
+import time
+import uuid
+import random
+import sqlite3
+import argparse
+import tempfile
+
+from app.services.backup_store.backup_store import BackupStore
+from app.services.route_services.db_ingest import hash_file
+
+def create_database(path: str, rows: int) -> None:
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE Mood (id INTEGER PRIMARY KEY, uuid TEXT UNIQUE, date TEXT, rating INTEGER, comment TEXT, updatedAt TEXT)")
+    conn.executemany(
+        "INSERT INTO Mood (uuid, date, rating, comment, updatedAt) VALUES (?, ?, ?, ?, ?)",
+        ((str(uuid.uuid4()), f"2024-01-{i % 28 + 1:02d}", i % 10, 'note ' * (i % 20), '2024-01-01') for i in range(rows))
+    )
+    conn.commit()
+    conn.close()
+
+def simulate_sync(path: str, changes: int) -> None:
+    conn = sqlite3.connect(path)
+    (max_id,) = conn.execute("SELECT MAX(id) FROM Mood").fetchone()
+    for _ in range(changes):
+        conn.execute("UPDATE Mood SET rating = ?, updatedAt = datetime('now') WHERE id = ?", (random.randint(0, 9), random.randint(1, max_id)))
+    conn.execute(
+        "INSERT INTO Mood (uuid, date, rating, comment, updatedAt) VALUES (?, date('now'), 5, 'new', datetime('now'))",
+        (str(uuid.uuid4()),)
+    )
+    conn.commit()
+    conn.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--syncs', type=int, default=50)
+    parser.add_argument('--changes', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'LocalDB.db')
+        create_database(db_path, args.rows)
+        store = BackupStore(os.path.join(tmp_dir, 'store'))
+
+        start = time.perf_counter()
+        for i in range(args.syncs):
+            store.add_backup(db_path, name=f"LocalDB_{i:05d}")
+            simulate_sync(db_path, args.changes)
+        backup_time = time.perf_counter() - start
+
+        stats = store.get_stats()
+        db_size = os.path.getsize(db_path)
+        print(f"Database size:      {db_size / 1e6:.1f} MB")
+        print(f"Backups stored:     {stats['backups']} ({store.codec})")
+        print(f"Full copies would:  {stats['logical_bytes'] / 1e6:.1f} MB")
+        print(f"Store uses:         {stats['stored_bytes'] / 1e6:.1f} MB")
+        print(f"Dedupe ratio:       {stats['dedupe_ratio']}x")
+        print(f"Full copies fit:    {stats['stored_bytes'] / db_size:.2f}")
+        print(f"Avg backup time:    {backup_time / args.syncs * 1000:.1f} ms")
+
+        restore_path = os.path.join(tmp_dir, 'restored.db')
+        name = store.list_backups()[len(store.list_backups()) // 2]
+        start = time.perf_counter()
+        store.restore_backup(name, restore_path)
+        restore_time = time.perf_counter() - start
+        assert hash_file(restore_path) == store.get_manifest(name)['sha256']
+        print(f"Restore time:       {restore_time * 1000:.1f} ms (byte-identical)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark for DatabaseManager.bulk_upsert.
+
+Imports a few years of synthetic QuantifiableHabits into a scratch database,
+once with the per-row upsert path and once with the batched executemany path,
+then re-imports the same frame to measure the all-skipped case. Run from the
+python/ folder:
+
+    python -m benchmarks.bulk_upsert_benchmark --days 1095 --habits 8
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import contextlib
+import tempfile
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'marimo'))
+from database_connection import DatabaseManager
+
+def create_database(path: str) -> None:
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE QuantifiableHabits (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uuid TEXT NOT NULL UNIQUE,
+            date TEXT NOT NULL,
+            habitKey TEXT NOT NULL,
+            value INTEGER NOT NULL,
+            createdAt TEXT NOT NULL,
+            updatedAt TEXT NOT NULL
+        )
+    """)
+    conn.commit()
+    conn.close()
+
+def make_frame(days: int, habits: int) -> pd.DataFrame:
+    dates = pd.date_range('2021-01-01', periods=days).strftime('%Y-%m-%d')
+    return pd.DataFrame(
+        [(date, f"habit{h}", (i + h) % 5) for i, date in enumerate(dates) for h in range(habits)],
+        columns=['date', 'habitKey', 'value']
+    )
+
+def per_row_upsert(db: DatabaseManager, table_name: str, df: pd.DataFrame) -> None:
+    """The previous bulk_upsert: one existence check, insert and read-back per row"""
+    db.connection.execute('BEGIN EXCLUSIVE')
+    for record in df.to_dict('records'):
+        db.upsert(table_name, record, in_transaction=True)
+    db.connection.commit()
+
+def timed(label: str, func, rows: int) -> None:
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36} {elapsed:8.3f} s  {rows / elapsed:12,.0f} rows/s")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=1095)
+    parser.add_argument('--habits', type=int, default=8)
+    args = parser.parse_args()
+
+    df = make_frame(args.days, args.habits)
+    print(f"Rows: {len(df):,}")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for label, runner in (('per-row upsert', per_row_upsert), ('batched bulk_upsert', None)):
+            db_path = os.path.join(tmp_dir, f"{label.replace(' ', '_')}.db")
+            create_database(db_path)
+            db = DatabaseManager(db_path)
+            with contextlib.redirect_stdout(None):
+                db.connect()
+
+            def run():
+                # upsert prints one line per skipped row, keep the output readable
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    if runner:
+                        runner(db, 'QuantifiableHabits', df)
+                    else:
+                        db.bulk_upsert('QuantifiableHabits', df)
+
+            timed(label, run, len(df))
+            timed(label + ' (all existing)', run, len(df))
+            with contextlib.redirect_stdout(None):
+                db.disconnect()
+
+if __name__ == '__main__':
+    main()
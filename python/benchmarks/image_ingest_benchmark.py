@@ -0,0 +1,74 @@
+"""
+Benchmark for image_sync.save_images.
+
+Ingests a batch of synthetic JPEGs (random payload between SOI/EOI markers, so
+no Pillow is needed) into a scratch image library, with its own staging folder
+and thumbnail cache, first serially and then on
+the ingest thread pool, and re-sends the batch to measure the all-duplicates
+case. Run from the python/ folder:
+
+    python -m benchmarks.image_ingest_benchmark --images 100 --size-mb 3
+"""
+import io
+import os
+import time
+import argparse
+import logging
+import tempfile
+from pathlib import Path
+
+from werkzeug.datastructures import FileStorage
+
+from logger import logger
+from app.config import THUMBNAIL_CACHE_MAX_BYTES
+from app.services.image_sync import image_sync
+from app.services.image_sync.image_index import ImageIndex
+from app.services.image_sync.thumbnails import ThumbnailCache
+
+class ScratchThumbnailCache(ThumbnailCache):
+    """Renders nothing: the synthetic payloads can't be decoded, and thumbnails aren't what is measured."""
+
+    def submit(self, source_path, sha256: str) -> None:
+        pass
+
+def make_jpegs(count: int, size: int):
+    return [b'\xff\xd8\xff\xe0' + os.urandom(size) + b'\xff\xd9' for _ in range(count)]
+
+def as_uploads(payloads):
+    return [FileStorage(stream=io.BytesIO(data), filename=f"IMG_{i:04d}.jpg") for i, data in enumerate(payloads)]
+
+def timed(label: str, payloads, workers: int) -> None:
+    total_mb = sum(len(data) for data in payloads) / (1024 * 1024)
+    start = time.perf_counter()
+    saved, duplicates = image_sync.save_images('2024-05-03', as_uploads(payloads), max_workers=workers)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed:8.3f} s  {len(payloads) / elapsed:8.1f} img/s  {total_mb / elapsed:8.1f} MB/s  "
+          f"saved={len(saved)} duplicates={duplicates}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=100)
+    parser.add_argument('--size-mb', type=float, default=3)
+    parser.add_argument('--workers', type=int, default=image_sync.IMAGE_INGEST_WORKERS)
+    args = parser.parse_args()
+
+    # One log line per image would drown the results
+    logger.setLevel(logging.WARNING)
+    print(f"Images: {args.images} x {args.size_mb} MB")
+
+    for label, workers in (('serial', 1), (f'thread pool ({args.workers})', args.workers)):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Point the ingest at a scratch library instead of the vault
+            # Staging has to be on the library's filesystem, uploads are linked from it into place
+            image_sync.IMAGE_LIBRARY_PATH = tmp_dir
+            image_sync.STAGING_PATH = Path(tmp_dir) / '.staging'
+            image_sync.image_index = ImageIndex(tmp_dir, os.path.join(tmp_dir, 'image_index.db'))
+            image_sync.thumbnail_cache = ScratchThumbnailCache(os.path.join(tmp_dir, 'thumbnails'), THUMBNAIL_CACHE_MAX_BYTES)
+
+            payloads = make_jpegs(args.images, int(args.size_mb * 1024 * 1024))
+            timed(label, payloads, workers)
+            timed(label + ' (all duplicates)', payloads, workers)
+            image_sync.image_index.connection.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Benchmark for the music metadata search.
+
+Fills a scratch metadata index with synthetic tracks (tags are inserted
+directly, no audio files are read) and times a mix of /music/search style
+queries. Run from the python/ folder:
+
+    python -m benchmarks.music_search_benchmark --tracks 100000
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+
+from app.services.music_sync.music_metadata import MusicMetadataIndex
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'ne', 'to', 'shi', 'ven', 'dor', 'al', 'ber', 'cy', 'fu', 'gra', 'hel', 'jo', 'ex', 'ul']
+
+def make_words(count: int, rng: random.Random):
+    """A made-up vocabulary, so term frequencies look like a real library's rather than a handful of words"""
+    return [''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(count)]
+
+def make_rows(tracks: int, words):
+    rng = random.Random(0)
+    rows = []
+    for i in range(tracks):
+        album_number, track_number = divmod(i, 12)
+        artist = f"{rng.choice(words).title()} {rng.choice(words).title()} {album_number % 2000}"
+        album = f"{rng.choice(words).title()} {rng.choice(words).title()}"
+        title = ' '.join(rng.choice(words) for _ in range(rng.randint(1, 4))).title()
+        rows.append((
+            f"{artist} - {album} {album_number}", f"{track_number + 1:02d} {title}.mp3", 5_000_000, i,
+            artist, album, title, track_number + 1, 180.0 + track_number
+        ))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tracks', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index = MusicMetadataIndex(tmp_dir, os.path.join(tmp_dir, 'music_index.db'))
+
+        start = time.perf_counter()
+        words = make_words(5000, random.Random(0))
+        rows = make_rows(args.tracks, words)
+        for offset in range(0, len(rows), 5000):
+            index._upsert(rows[offset:offset + 5000])
+        print(f"Indexed {args.tracks:,} tracks in {time.perf_counter() - start:.2f} s")
+
+        rng = random.Random(1)
+        queries = [' '.join(rng.choice(words)[:rng.randint(3, 6)] for _ in range(rng.randint(1, 3))) for _ in range(args.queries)]
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        timings.sort()
+        print(f"{len(queries)} queries: median {timings[len(timings) // 2]:.2f} ms, "
+              f"p95 {timings[int(len(timings) * 0.95)]:.2f} ms, max {timings[-1]:.2f} ms")
+
+if __name__ == '__main__':
+    main()
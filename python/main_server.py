@@ -1,8 +1,8 @@
 from app import create_app
 
-app = create_app()
-
+# Guarded so worker processes (spawn/forkserver), which import this module, don't build the app
 if __name__ == '__main__':
+    app = create_app()
     app.run(host='0.0.0.0', port=5050, debug=True)
 
 
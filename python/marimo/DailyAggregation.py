@@ -45,10 +45,10 @@ def _():
 @app.cell
 def _(DataProcessing, DatabaseManager):
     db = DatabaseManager()
-    dp = DataProcessing()
     db.connect()
+    dp = DataProcessing(db)
     tables = db.get_tables()
-    print(list(vars(tables).keys()))
+    print(list(tables))
     return db, dp, tables
 
 
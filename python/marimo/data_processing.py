@@ -2,9 +2,12 @@ import pandas as pd
 from database_connection import DatabaseManager
 
 class DataProcessing:
-    def __init__(self):
-        self.db = DatabaseManager()
-        self.db.connect()
+    def __init__(self, db: DatabaseManager = None):
+        # Share the notebook's connection, so tables are only loaded once
+        if db is None:
+            db = DatabaseManager()
+            db.connect()
+        self.db = db
         self.tables = self.db.get_tables()
 
     def merge_quantifiable_habits(self):
@@ -1,17 +1,23 @@
 import sqlite3
 import os
 from typing import List, Tuple, Any, Optional
-from types import SimpleNamespace
 import pandas as pd
 import uuid
 from datetime import datetime, timezone
 
+from table_cache import TableCache
+
 class DatabaseManager:
-    def __init__(self, db_path: str = '/home/stefano/Github/LoSMinimal/python/database_files/LocalDB.db'):
+    def __init__(self, db_path: str = '/home/stefano/Github/LoSMinimal/python/database_files/LocalDB.db', use_cache: bool = True):
         """Initialize database connection"""
         self.db_path = os.path.abspath(db_path)
+        # Feather files of whole tables keyed by the database hash, skipped if pyarrow is missing
+        self.columnar_cache = TableCache(self.db_path) if use_cache and TableCache.is_available() else None
         self.connection = None
         self.cursor = None
+        # DataFrames loaded by LazyTables, shared by every namespace from this connection
+        self.table_cache = {}
+        self.table_cache_signature = None
 
     def connect(self) -> None:
         """Establish database connection"""
@@ -41,25 +47,24 @@ class DatabaseManager:
             print(f"❌ Query execution error: {str(e)}")
             return None
             
-    def get_tables(self) -> SimpleNamespace:
-        """Get list of all tables as a namespace with table contents as DataFrames"""
+    def get_file_signature(self) -> Optional[Tuple[int, int, int]]:
+        """Identity of the database file on disk, changes whenever a sync replaces or edits it"""
+        try:
+            stat = os.stat(self.db_path)
+            return stat.st_ino, stat.st_size, stat.st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def get_tables(self, typed: bool = False) -> 'LazyTables':
+        """
+        Get all tables as a namespace of DataFrames, each loaded on first access.
+        With typed=True dates are datetimes and tag/habitKey are categoricals.
+        """
         query = "SELECT name FROM sqlite_master WHERE type='table'"
-        tables = self.execute_query(query)
-        if tables:
-            # Filter out unwanted tables
-            filtered_tables = [table[0] for table in tables if table[0] not in ('android_metadata', 'sqlite_sequence')]
-            # Fetch the contents of each table and convert to DataFrame
-            tables_data = {}
-            for table in filtered_tables:
-                try:
-                    df = pd.read_sql_query(f"SELECT * FROM {table}", self.connection)
-                    tables_data[table] = df
-                except Exception as e:
-                    print(f"❌ Error fetching data for table `{table}`: {e}")
-                    tables_data[table] = None
-            # Convert the dictionary to a namespace
-            return SimpleNamespace(**tables_data)
-        return SimpleNamespace()
+        tables = self.execute_query(query) or []
+        # Filter out unwanted tables
+        filtered_tables = [table[0] for table in tables if table[0] not in ('android_metadata', 'sqlite_sequence')]
+        return LazyTables(self, filtered_tables, typed)
 
     def get_table_schema(self, table_name: str) -> None:
         """Display schema for a specific table"""
@@ -174,47 +179,204 @@ class DatabaseManager:
             print(f"Data causing error: {data}")
             return None
         
-    def bulk_upsert(self, table_name: str, df: pd.DataFrame) -> None:
+    # Natural keys used to skip rows that already exist, other tables only conflict on uuid
+    CONFLICT_KEYS = {
+        'DailyNotes': ('date',),
+        'QuantifiableHabits': ('date', 'habitKey'),
+    }
+
+    def _prepare_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Fill uuid/createdAt/updatedAt for the whole frame at once and turn NaN into NULL"""
+        records = df.copy()
+        now = datetime.now(timezone.utc).isoformat()
+
+        if 'uuid' not in records.columns:
+            records['uuid'] = None
+        missing_uuid = records['uuid'].isna() | (records['uuid'] == '')
+        records.loc[missing_uuid, 'uuid'] = [str(uuid.uuid4()) for _ in range(missing_uuid.sum())]
+
+        if 'createdAt' not in records.columns:
+            records['createdAt'] = now
+        records['createdAt'] = records['createdAt'].fillna(now)
+        records['updatedAt'] = now
+
+        return records.astype(object).where(records.notna(), None)
+
+    def _has_unique_index(self, table_name: str, columns: Tuple[str, ...]) -> bool:
+        """Check if a UNIQUE constraint covers exactly these columns"""
+        for idx in self.execute_query(f"PRAGMA index_list({table_name})") or []:
+            if idx[2]:
+                idx_columns = self.execute_query(f"PRAGMA index_info({idx[1]})") or []
+                if {col[2] for col in idx_columns} == set(columns):
+                    return True
+        return False
+
+    def create_unique_index(self, table_name: str) -> bool:
         """
-        Bulk upsert a pandas DataFrame into a table
+        Opt-in: add a UNIQUE index on the table's natural key, so bulk_upsert can use ON CONFLICT.
+        This changes the phone's database schema (later phone inserts must respect it), so it is
+        never done implicitly. Returns False if existing duplicates prevent it.
         """
-        success_count = 0
-        error_count = 0
-        
+        columns = self.CONFLICT_KEYS.get(table_name, ('uuid',))
+        if self._has_unique_index(table_name, columns):
+            return True
         try:
-            # Convert DataFrame to list of dictionaries
-            records = df.to_dict('records')
-            
-            # Close and reopen connection to ensure clean state
-            self.disconnect()
-            self.connect()
-            
-            # Start a single transaction for the entire operation
-            self.connection.execute('BEGIN EXCLUSIVE')
-            
-            # Upsert each record
-            for i, record in enumerate(records, 1):
-                try:
-                    result = self.upsert(table_name, record, in_transaction=True)
-                    if result:
-                        success_count += 1
-                    else:
-                        error_count += 1
-                except Exception as row_error:
-                    error_count += 1
-                    print(f"⚠️ Skipping row {i}: {str(row_error)}")
-                    continue
-                
-                if i % 100 == 0:  # Progress update every 100 records
-                    print(f"Processed {i}/{len(records)} records...")
-            
-            # Commit all changes at once
+            self.connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_{}_{} ON {} ({})".format(
+                table_name, '_'.join(columns), table_name, ','.join(columns)
+            ))
             self.connection.commit()
-            print(f"✅ Completed: {success_count} successful, {error_count} failed out of {len(records)} total records")
-            
+            print(f"🔑 Created unique index on {table_name}({', '.join(columns)})")
+            return True
+        except sqlite3.IntegrityError:
+            print(f"⚠️ {table_name} has duplicate ({', '.join(columns)}) rows, not creating a unique index")
+            return False
+
+    def bulk_upsert(self, table_name: str, df: pd.DataFrame) -> Optional[dict]:
+        """
+        Bulk upsert a pandas DataFrame into a table.
+        Rows whose natural key already exists are skipped; everything is written with
+        a single executemany inside one transaction. Returns inserted/skipped counts.
+        """
+        try:
+            records = self._prepare_frame(df)
+            columns = list(records.columns)
+            conflict_keys = self.CONFLICT_KEYS.get(table_name, ('uuid',))
+
+            # total_changes sums changes() over every row of the executemany
+            changes_before = self.connection.total_changes
+            self.connection.execute('BEGIN')
+            if self._has_unique_index(table_name, conflict_keys):
+                query = "INSERT INTO {} ({}) VALUES ({}) ON CONFLICT({}) DO NOTHING".format(
+                    table_name,
+                    ','.join(columns),
+                    ','.join(['?' for _ in columns]),
+                    ','.join(conflict_keys)
+                )
+                rows = records.itertuples(index=False, name=None)
+            else:
+                # No index (see create_unique_index): read the existing keys once, insert only new ones
+                existing = set(self.connection.execute(
+                    "SELECT {} FROM {}".format(','.join(conflict_keys), table_name)
+                ).fetchall())
+                key_positions = [columns.index(key) for key in conflict_keys]
+                rows = []
+                for row in records.itertuples(index=False, name=None):
+                    key = tuple(row[i] for i in key_positions)
+                    if key not in existing:
+                        existing.add(key)
+                        rows.append(row)
+                query = "INSERT INTO {} ({}) VALUES ({})".format(
+                    table_name,
+                    ','.join(columns),
+                    ','.join(['?' for _ in columns])
+                )
+            self.cursor.executemany(query, rows)
+            self.connection.commit()
+
+            inserted = self.connection.total_changes - changes_before
+            skipped = len(records) - inserted
+            print(f"✅ Completed: {inserted} inserted, {skipped} skipped out of {len(records)} total records")
+            return {"inserted": inserted, "skipped": skipped}
+
         except Exception as e:
             self.connection.rollback()
             print(f"❌ Bulk upsert error: {str(e)}")
-        finally:
-            # Ensure we're back in autocommit mode
-            self.connection.rollback()
\ No newline at end of file
+            return None
+
+
+class LazyTables:
+    """
+    Namespace of table DataFrames, loaded from SQL on first attribute access.
+
+    `tables.Mood` loads the whole table once; `tables.load('Mood', columns=[...],
+    start_date=..., end_date=...)` pushes the projection and date range down into
+    SQL. Loaded frames are memoized per connection and dropped (with a reconnect)
+    when the database file changes on disk, e.g. after a phone sync.
+    """
+
+    def __init__(self, db: DatabaseManager, table_names: List[str], typed: bool = False):
+        self._db = db
+        self._table_names = list(table_names)
+        self._typed = typed
+        if db.table_cache_signature is None:
+            db.table_cache_signature = db.get_file_signature()
+
+    def __getattr__(self, name: str) -> pd.DataFrame:
+        if name.startswith('_') or name not in self._table_names:
+            raise AttributeError(f"No table named `{name}`")
+        return self.load(name)
+
+    def __iter__(self):
+        return iter(self._table_names)
+
+    def __dir__(self):
+        return list(super().__dir__()) + self._table_names
+
+    def __repr__(self):
+        return f"LazyTables({', '.join(self._table_names)})"
+
+    def _check_fresh(self) -> None:
+        signature = self._db.get_file_signature()
+        if signature != self._db.table_cache_signature:
+            # The open connection still points at the old file, reopen it
+            print("🔄 Database changed on disk, reloading tables")
+            self._db.table_cache.clear()
+            self._db.disconnect()
+            self._db.connect()
+            self._db.table_cache_signature = signature
+
+    def load(self, table_name: str, columns: Optional[List[str]] = None, start_date: Optional[str] = None,
+             end_date: Optional[str] = None, date_column: str = 'date') -> Optional[pd.DataFrame]:
+        """
+        Load a table, optionally only some columns and rows within [start_date, end_date].
+        Returns a copy of the memoized frame, so cells can modify it without
+        changing what other cells (and DataProcessing) get.
+        """
+        df = self._load_cached(table_name, columns, start_date, end_date, date_column)
+        return df.copy() if df is not None else None
+
+    def _load_cached(self, table_name: str, columns: Optional[List[str]], start_date: Optional[str],
+                     end_date: Optional[str], date_column: str) -> Optional[pd.DataFrame]:
+        if table_name not in self._table_names:
+            raise AttributeError(f"No table named `{table_name}`")
+        self._check_fresh()
+
+        key = (table_name, tuple(columns) if columns else None, start_date, end_date, date_column, self._typed)
+        if key in self._db.table_cache:
+            return self._db.table_cache[key]
+
+        known_columns = [col[1] for col in self._db.execute_query(f'PRAGMA table_info("{table_name}")') or []]
+        for col in (columns or []) + ([date_column] if start_date or end_date else []):
+            if col not in known_columns:
+                raise ValueError(f"Unknown column `{col}` in table `{table_name}`")
+
+        # Whole-table reads come from the columnar cache, date ranges are pushed down into SQL
+        if self._db.columnar_cache and not (start_date or end_date):
+            try:
+                df = self._db.columnar_cache.load(table_name, self._db.connection, columns, self._typed)
+                self._db.table_cache[key] = df
+                return df
+            except Exception as e:
+                print(f"⚠️ Columnar cache unavailable for `{table_name}`, reading from SQLite: {e}")
+
+        select = ','.join(f'"{col}"' for col in columns) if columns else '*'
+        conditions, params = [], []
+        if start_date:
+            conditions.append(f'"{date_column}" >= ?')
+            params.append(start_date)
+        if end_date:
+            conditions.append(f'"{date_column}" <= ?')
+            params.append(end_date)
+        query = f'SELECT {select} FROM "{table_name}"'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+
+        try:
+            df = pd.read_sql_query(query, self._db.connection, params=params)
+            if self._typed:
+                df = TableCache.convert_dtypes(df)
+        except Exception as e:
+            print(f"❌ Error fetching data for table `{table_name}`: {e}")
+            df = None
+        self._db.table_cache[key] = df
+        return df
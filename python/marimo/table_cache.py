@@ -0,0 +1,111 @@
+import os
+import json
+import shutil
+import hashlib
+from typing import List, Optional, Tuple
+
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+# Low-cardinality text columns stored as categoricals
+CATEGORICAL_COLUMNS = ('tag', 'habitKey')
+DATE_COLUMNS = ('date',)
+
+class TableCache:
+    """
+    Columnar on-disk cache of LocalDB tables for the notebooks.
+
+    Each table is written once as an uncompressed Feather file under a folder
+    named after the database content hash, and memory-mapped on load. Reopening
+    a notebook after an unchanged sync skips SQLite entirely.
+
+    Typed loads store proper dtypes (categorical tag/habitKey, datetime date) so
+    string parsing also happens only once. They are opt-in because existing
+    notebook code merges on string dates and groups on plain tags.
+    """
+
+    def __init__(self, db_path: str, cache_dir: Optional[str] = None, keep_versions: int = 2):
+        self.db_path = os.path.abspath(db_path)
+        self.cache_dir = cache_dir or os.path.join(os.path.dirname(self.db_path), '.table_cache')
+        self.keep_versions = keep_versions
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def is_available() -> bool:
+        return feather is not None
+
+    def _signature(self) -> List[int]:
+        stat = os.stat(self.db_path)
+        return [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+    def get_db_hash(self) -> str:
+        """SHA-256 of the database, rehashed only when the file's inode/size/mtime change"""
+        index_path = os.path.join(self.cache_dir, 'index.json')
+        signature = self._signature()
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+            if index['signature'] == signature:
+                return index['sha256']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        sha = hashlib.sha256()
+        with open(self.db_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        index = {'signature': signature, 'sha256': sha.hexdigest()}
+
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+        return index['sha256']
+
+    @staticmethod
+    def convert_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+        """Parse ISO dates once and turn repeated labels into categoricals"""
+        for col in DATE_COLUMNS:
+            if col in df.columns and pd.api.types.is_string_dtype(df[col]):
+                parsed = pd.to_datetime(df[col], format='%Y-%m-%d', errors='coerce')
+                # Only convert if every non-null value is a plain date (GPT uses '2024-11' months)
+                if parsed.notna().sum() == df[col].notna().sum():
+                    df[col] = parsed
+        for col in CATEGORICAL_COLUMNS:
+            if col in df.columns and pd.api.types.is_string_dtype(df[col]):
+                df[col] = df[col].astype('category')
+        return df
+
+    def _version_dir(self) -> str:
+        return os.path.join(self.cache_dir, self.get_db_hash())
+
+    def _prune(self, current: str) -> None:
+        versions = [
+            os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+            if os.path.isdir(os.path.join(self.cache_dir, name))
+        ]
+        versions.sort(key=os.path.getmtime, reverse=True)
+        for path in [v for v in versions if v != current][self.keep_versions - 1:]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def load(self, table_name: str, connection, columns: Optional[Tuple[str, ...]] = None, typed: bool = False) -> pd.DataFrame:
+        """Load a table from the cache, building the cache file from SQLite on a miss"""
+        version_dir = self._version_dir()
+        path = os.path.join(version_dir, f"{table_name}{'.typed' if typed else ''}.feather")
+
+        if not os.path.exists(path):
+            df = pd.read_sql_query(f'SELECT * FROM "{table_name}"', connection)
+            if typed:
+                df = self.convert_dtypes(df)
+            os.makedirs(version_dir, exist_ok=True)
+            tmp_path = path + '.tmp'
+            feather.write_feather(df, tmp_path, compression='uncompressed')
+            os.replace(tmp_path, path)
+            self._prune(version_dir)
+
+        table = feather.read_table(path, columns=list(columns) if columns else None, memory_map=True)
+        return table.to_pandas()
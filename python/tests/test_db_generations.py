@@ -0,0 +1,57 @@
+import os
+import sqlite3
+
+from app.services.route_services.db_generations import GenerationRegistry, hash_file
+
+def create_database(path, rows):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE notes (id INTEGER PRIMARY KEY, body TEXT)")
+    connection.executemany("INSERT INTO notes (body) VALUES (?)", [(row,) for row in rows])
+    connection.commit()
+    connection.close()
+
+def test_writes_through_db_path_do_not_change_published_generation(tmp_path):
+    db_path = str(tmp_path / 'LocalDB.db')
+    registry = GenerationRegistry(str(tmp_path / 'generations'), db_path)
+
+    upload_path = str(tmp_path / 'upload.tmp')
+    create_database(upload_path, ['first'])
+    sha = hash_file(upload_path)
+    generation = registry.publish(upload_path, sha)
+    with open(generation.path, 'rb') as f:
+        published = f.read()
+
+    pinned = registry.acquire(generation)
+    connection = sqlite3.connect(db_path)
+    connection.execute("INSERT INTO notes (body) VALUES ('written by a notebook')")
+    connection.commit()
+    connection.close()
+
+    with open(generation.path, 'rb') as f:
+        assert f.read() == published
+    assert hash_file(generation.path) == generation.sha == sha
+
+    # The write is picked up as a new generation, named after its own bytes
+    imported = registry.acquire()
+    assert imported.number == generation.number + 1
+    assert hash_file(imported.path) == imported.sha == hash_file(db_path)
+    assert not os.path.samefile(imported.path, db_path)
+    registry.release(imported)
+    registry.release(pinned)
+
+def test_hardlinked_db_path_is_split_off_at_startup(tmp_path):
+    generations_path = tmp_path / 'generations'
+    generations_path.mkdir()
+    generation_path = str(generations_path / 'tmp.db')
+    create_database(generation_path, ['first'])
+    sha = hash_file(generation_path)
+    final_path = str(generations_path / f"00000001-{sha}.db")
+    os.rename(generation_path, final_path)
+    db_path = str(tmp_path / 'LocalDB.db')
+    os.link(final_path, db_path)
+
+    registry = GenerationRegistry(str(generations_path), db_path)
+
+    assert registry.current.number == 1
+    assert not os.path.samefile(final_path, db_path)
+    assert hash_file(db_path) == sha